@@ -0,0 +1,72 @@
+# admission of the motion alerts: the alerts of a camera arriving within a window are grouped into one detection job
+# the group stays open while its job waits for the car to be parked, each joining alert pushes the snapshot back
+import threading
+import time
+
+
+class AlertGroup:
+
+    def __init__(self, deviceSerial, deviceName, occurredAt):
+        self.deviceSerial = deviceSerial
+        self.deviceName = deviceName
+        self.firstOccurredAt = occurredAt
+        self.lastOccurredAt = occurredAt
+        self.openedAt = time.monotonic()
+        self.lastMotionAt = self.openedAt
+        self.alerts = [occurredAt]
+        self.closed = False
+
+
+class AlertCoalescer:
+
+    # window: max seconds between the first alert of a group and the snapshot, 0 gives every alert its own job
+    def __init__(self, window=30):
+        self.window = window
+        self.groups = {}
+        self.coalescedCount = 0
+        self.condition = threading.Condition()
+
+    # returns the group of the alert, and True if it is a new group that needs a job
+    def admit(self, deviceSerial, deviceName, occurredAt):
+        with self.condition:
+            group = self.groups.get(deviceSerial)
+            if group is not None and time.monotonic() - group.openedAt < self.window:
+                group.firstOccurredAt = min(group.firstOccurredAt, occurredAt)
+                group.lastOccurredAt = max(group.lastOccurredAt, occurredAt)
+                group.lastMotionAt = time.monotonic()
+                group.alerts.append(occurredAt)
+                self.coalescedCount += 1
+                self.condition.notify_all()
+                return group, False
+
+            group = AlertGroup(deviceSerial, deviceName, occurredAt)
+            self.groups[deviceSerial] = group
+            return group, True
+
+    # wait until waitTime after the last motion of the group, at most max(window, waitTime) after the first one
+    # then close the group, later alerts of the camera open a new one
+    # returns the seconds between the first alert and the end of the wait
+    def hold(self, group, waitTime):
+        with self.condition:
+            while True:
+                end = min(group.lastMotionAt + waitTime, group.openedAt + max(self.window, waitTime))
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            self._close(group)
+        return end - group.openedAt
+
+    # the job of the group could not be queued
+    def discard(self, group):
+        with self.condition:
+            self._close(group)
+
+    def _close(self, group):
+        group.closed = True
+        if self.groups.get(group.deviceSerial) is group:
+            del self.groups[group.deviceSerial]
+
+    def stats(self):
+        with self.condition:
+            return {'openGroups': len(self.groups), 'coalesced': self.coalescedCount}
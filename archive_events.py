@@ -0,0 +1,57 @@
+# archive the old car events, or search the archive
+# usage: python archive_events.py roll [--days 30] [--json-file db_server.json]
+#        python archive_events.py query [--plate B1234XYZ] [--location 'CAMERA NAME'] [--since 2021-06-01] [--until 2021-06-30]
+#        python archive_events.py snapshots [--plate B1234XYZ] [--order 12] [--camera SERIAL] [--since ...] [--export DIR]
+# without --json-file, the events are moved out of the database configured in .env (DB_BACKEND, DB_HOST or DB_PATH)
+
+import os
+import json
+import argparse
+from dotenv import load_dotenv
+from db_client import DBClient
+from event_archive import EventArchive, rollOverEvents
+from snapshot_store import SnapshotStore
+from storage import JsonServerStore, JsonFileStore, SqliteStore
+
+load_dotenv()
+
+parser = argparse.ArgumentParser()
+parser.add_argument('command', choices=['roll', 'query', 'snapshots'])
+parser.add_argument('--archive', default=os.getenv('ARCHIVE_DIR', 'archive'))
+parser.add_argument('--snapshot-archive', default=os.getenv('SNAPSHOT_ARCHIVE_DIR') or 'snapshots')
+parser.add_argument('--days', type=float, default=float(os.getenv('ARCHIVE_AFTER_DAYS') or 30))
+parser.add_argument('--json-file', help='JSON-server database file, JSON-server must be stopped')
+parser.add_argument('--plate')
+parser.add_argument('--location')
+parser.add_argument('--since')
+parser.add_argument('--until')
+parser.add_argument('--camera', help='camera serial of the archived snapshots')
+parser.add_argument('--order', type=int, help='order id of the archived snapshots')
+parser.add_argument('--limit', type=int, default=100)
+parser.add_argument('--export', help='directory where the archived snapshots found are copied')
+args = parser.parse_args()
+
+if args.command == 'snapshots':
+    store = SnapshotStore(args.snapshot_archive)
+    for entry in store.find(args.plate, args.order, args.camera, args.since, args.until, args.limit):
+        if args.export:
+            os.makedirs(args.export, exist_ok=True)
+            name = '{}_{}_{}.jpg'.format(entry['time'], entry['camera'], entry['plate'] or 'no-plate')
+            entry['path'] = os.path.join(args.export, name.replace(':', '-'))
+            with store.open(entry['digest']) as content, open(entry['path'], 'wb') as f:
+                f.write(content)
+        print(json.dumps(entry))
+
+elif args.command == 'roll':
+    archive = EventArchive(args.archive)
+    if args.json_file:
+        store = JsonFileStore(args.json_file)
+    elif os.getenv('DB_BACKEND', 'json-server') == 'sqlite':
+        store = SqliteStore(os.getenv('DB_PATH', 'db_server.sqlite'))
+    else:
+        store = JsonServerStore(DBClient(os.getenv('DB_HOST')))
+    rollOverEvents(store, archive, args.days)
+else:
+    archive = EventArchive(args.archive)
+    for event in archive.query(args.plate, args.location, args.since, args.until):
+        print(json.dumps(event))
@@ -0,0 +1,87 @@
+# cards rendered per second: precompiled CARD_TEMPLATE vs filling a deep copy of CARD_CONTENT
+# then renders from many threads at once and checks that no card carries fields of another order
+# usage: python benchmarks/card_renderer_benchmark.py [cards] [threads]
+import os
+import sys
+import copy
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from card_renderer import CARD_MESSAGE, CARD_TEMPLATE  # noqa: E402
+
+
+def orderValues(i):
+    return {
+        'roomId': 'room',
+        'iconUrl': 'https://example.com/icon.png',
+        'title': 'CUSTOMER HAS ARRIVED',
+        'titleColor': 'Accent',
+        'plate': '[PLATE %d](https://example.com/%d.jpg)' % (i, i),
+        'customer': 'Customer %d' % i,
+        'menu': 'Menu %d / %d' % (i, i % 5),
+        'orderTime': '18-May-2021 (12:00) / #%d' % i,
+        'imageUrl': 'https://example.com/%d.jpg' % i,
+        'orderId': i
+    }
+
+
+# the previous way, with a copy so that it is thread safe
+def renderDeepCopy(values):
+    message = copy.deepcopy(CARD_MESSAGE)
+    message['roomId'] = values['roomId']
+    card = message['attachments'][0]['content']
+    card["body"][0]["columns"][0]["items"][0]['url'] = values['iconUrl']
+    card["body"][0]["columns"][1]["items"][1]['text'] = values['title']
+    card["body"][0]["columns"][1]["items"][1]['color'] = values['titleColor']
+    card["body"][1]["columns"][1]["items"][0]['text'] = values['plate']
+    card["body"][1]["columns"][1]["items"][1]['text'] = values['customer']
+    card["body"][1]["columns"][1]["items"][2]['text'] = values['menu']
+    card["body"][1]["columns"][1]["items"][3]['text'] = values['orderTime']
+    card["body"][2]["url"] = values['imageUrl']
+    card["body"][3]["actions"][0]["data"]["orderId"] = str(values['orderId'])
+    card["body"][3]["actions"][1]["data"]["orderId"] = str(values['orderId'])
+    return json.dumps(message, separators=(',', ':'))
+
+
+def cardsPerSecond(render, cards):
+    values = [orderValues(i) for i in range(cards)]
+    start = time.perf_counter()
+    for v in values:
+        render(v)
+    return cards / (time.perf_counter() - start)
+
+
+# every field of the rendered card must belong to the same order
+def checkCard(i, text):
+    card = json.loads(text)['attachments'][0]['content']
+    fields = [card["body"][1]["columns"][1]["items"][0]['text'],
+              card["body"][1]["columns"][1]["items"][1]['text'],
+              card["body"][2]["url"],
+              card["body"][3]["actions"][0]["data"]["orderId"],
+              card["body"][3]["actions"][1]["data"]["orderId"]]
+    expected = [orderValues(i)['plate'], orderValues(i)['customer'],
+                orderValues(i)['imageUrl'], str(i), str(i)]
+    return fields == expected
+
+
+if __name__ == '__main__':
+    cards = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    assert json.loads(renderDeepCopy(orderValues(1))) == json.loads(
+        CARD_TEMPLATE.render(**orderValues(1)))
+
+    print('deepcopy + json.dumps   {:10.0f} cards/sec'.format(
+        cardsPerSecond(renderDeepCopy, cards)))
+    print('CARD_TEMPLATE.render    {:10.0f} cards/sec'.format(
+        cardsPerSecond(lambda v: CARD_TEMPLATE.render(**v), cards)))
+
+    with ThreadPoolExecutor(threads) as pool:
+        results = pool.map(lambda i: checkCard(i, CARD_TEMPLATE.render(**orderValues(i))),
+                           range(cards))
+        mixed = sum(1 for ok in results if not ok)
+    print('{} cards rendered by {} threads, {} with fields of another order'.format(
+        cards, threads, mixed))
+    sys.exit(1 if mixed else 0)
@@ -0,0 +1,54 @@
+# micro-benchmark: per-call latency of the DB helpers, one connection per call vs the pooled DBClient
+# usage: python benchmarks/db_client_benchmark.py [calls] [DB_HOST]
+# without DB_HOST, an in-memory json-server stand-in loaded with db_server.json is used
+import os
+import sys
+import json
+import time
+import statistics
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from db_client import DBClient  # noqa: E402
+from fake_json_server import FakeJsonServer  # noqa: E402
+
+
+# the way the helpers used to call the DB: new connection, headers and payload per call
+def getOrderPerCall(host, plate):
+    url = host + '/order?car_plate=' + plate + '&_sort=id&_order=desc&_limit=1'
+    headers = {'Content-Type': 'application/json'}
+    return requests.request('GET', url, headers=headers, data={})
+
+
+def timeCalls(func, calls):
+    samples = []
+    for i in range(calls):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    print('{:<22} mean {:7.3f} ms   p50 {:7.3f} ms   p99 {:7.3f} ms'.format(
+        name, statistics.mean(samples), samples[len(samples) // 2],
+        samples[int(len(samples) * 0.99) - 1]))
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    if len(sys.argv) > 2:
+        host = sys.argv[2]
+    else:
+        with open(os.path.join(ROOT, 'db_server.json')) as f:
+            host = FakeJsonServer(json.load(f)).start().url
+
+    dbClient = DBClient(host)
+    plate = 'MY70 BMW'
+
+    report('requests.request', timeCalls(
+        lambda: getOrderPerCall(host, plate), calls))
+    report('DBClient (pooled)', timeCalls(
+        lambda: dbClient.getLatestOrder(plate), calls))
@@ -0,0 +1,241 @@
+# local stand-ins for the cloud services used by the flask server: Meraki snapshots, Webex messages and Google Vision
+# a scenario describes what google vision sees on a snapshot: {'labels': [('Car', 0.95)], 'text': 'AB12\nCDE'}
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from google.api_core.exceptions import ServiceUnavailable
+from google.cloud import vision
+from collections import Counter
+from urllib.parse import urlparse
+import numpy as np
+from PIL import Image
+import threading
+import hashlib
+import random
+import json
+import time
+import io
+import re
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, port=0):
+        super().__init__(('127.0.0.1', port), handler)
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=None, contentType='application/json'):
+        if body is None:
+            data = b''
+        elif isinstance(body, bytes):
+            data = body
+        else:
+            data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def readBody(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+
+# snapshot noise image, a different one each time so the snapshot dedupe and the vision cache never hit
+def noiseJpeg(size):
+    pixels = np.random.randint(0, 256, (size[1], size[0]), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=70)
+    return buffer.getvalue()
+
+
+# Meraki dashboard API: generateSnapshot, then the snapshot url answers 404 until the snapshot is ready
+class FakeMeraki(FakeServer):
+
+    # scenarioFor(serial, timestamp): returns (scenario, tag), the tag is kept with the snapshot for the caller
+    def __init__(self, scenarioFor, readyDelay=2.0, readyJitter=0.5, imageSize=(320, 240), port=0):
+        super().__init__(FakeMerakiHandler, port)
+        self.scenarioFor = scenarioFor
+        self.readyDelay = readyDelay
+        self.readyJitter = readyJitter
+        self.imageSize = imageSize
+        self.snapshots = {}
+        self.images = {}
+
+    def generate(self, serial, timestamp):
+        scenario, tag = self.scenarioFor(serial, timestamp)
+        content = noiseJpeg(self.imageSize)
+        delay = max(0, self.readyDelay + random.uniform(-self.readyJitter, self.readyJitter))
+        with self.lock:
+            snapshotId = len(self.snapshots) + 1
+            url = '{}/snapshots/{}.jpg'.format(self.url, snapshotId)
+            self.snapshots[snapshotId] = {'serial': serial, 'timestamp': timestamp, 'tag': tag,
+                                          'readyAt': time.monotonic() + delay, 'content': content}
+            self.images[hashlib.sha256(content).hexdigest()] = scenario
+            self.images[url] = scenario
+        return url
+
+    # tag of the snapshot behind a url found in a message, None if there is none
+    def tagOf(self, text):
+        found = re.search(r'/snapshots/(\d+)\.jpg', text)
+        if found is None:
+            return None
+        with self.lock:
+            return self.snapshots[int(found.group(1))]['tag']
+
+
+class FakeMerakiHandler(FakeHandler):
+
+    def do_POST(self):
+        found = re.match(r'.*/devices/([^/]+)/camera/generateSnapshot$', urlparse(self.path).path)
+        body = json.loads(self.readBody() or b'{}')
+        if found is None:
+            return self.reply(404, {'errors': ['Not found']})
+        self.server.count('generateSnapshot')
+        url = self.server.generate(found.group(1), body.get('timestamp'))
+        self.reply(202, {'url': url, 'expiry': '2099-01-01T00:00:00Z'})
+
+    def do_GET(self):
+        found = re.match(r'/snapshots/(\d+)\.jpg$', urlparse(self.path).path)
+        with self.server.lock:
+            snapshot = self.server.snapshots.get(int(found.group(1))) if found else None
+        if snapshot is None or time.monotonic() < snapshot['readyAt']:
+            self.server.count('snapshotNotReady')
+            return self.reply(404, {'errors': ['Not ready']})
+        self.server.count('snapshotDownload')
+        self.reply(200, snapshot['content'], 'image/jpeg')
+
+
+# Webex messages and attachment actions, onMessage(message, receivedAt) is called for each posted message
+class FakeWebex(FakeServer):
+
+    def __init__(self, onMessage=None, port=0):
+        super().__init__(FakeWebexHandler, port)
+        self.onMessage = onMessage
+        self.messages = {}
+        self.actions = {}
+        self.sequence = 0
+
+    # what webex stores when a card button is pressed, returns the attachment action id
+    def pressButton(self, messageId, inputs):
+        with self.lock:
+            self.sequence += 1
+            actionId = 'action-%d' % self.sequence
+            self.actions[actionId] = {'id': actionId, 'type': 'submit', 'messageId': messageId,
+                                      'inputs': inputs, 'created': '2021-01-01T00:00:00.000Z'}
+        return actionId
+
+
+class FakeWebexHandler(FakeHandler):
+
+    def do_POST(self):
+        if not urlparse(self.path).path.endswith('/messages'):
+            return self.reply(404, {'message': 'Not found'})
+        self.server.count('postMessage')
+        message = json.loads(self.readBody())
+        with self.server.lock:
+            self.server.sequence += 1
+            message = dict(message, id='message-%d' % self.server.sequence,
+                           created='2021-01-01T00:00:00.000Z')
+            self.server.messages[message['id']] = message
+        if self.server.onMessage is not None:
+            self.server.onMessage(message, time.monotonic())
+        self.reply(200, message)
+
+    def do_GET(self):
+        found = re.match(r'.*/attachment/actions/([^/]+)$', urlparse(self.path).path)
+        self.server.count('getAttachmentAction')
+        with self.server.lock:
+            action = self.server.actions.get(found.group(1)) if found else None
+        if action is None:
+            return self.reply(404, {'message': 'Not found'})
+        self.reply(200, action)
+
+    def do_DELETE(self):
+        found = re.match(r'.*/messages/([^/]+)$', urlparse(self.path).path)
+        self.server.count('deleteMessage')
+        with self.server.lock:
+            message = self.server.messages.pop(found.group(1), None) if found else None
+        if message is None:
+            return self.reply(404, {'message': 'Not found'})
+        self.reply(204)
+
+
+# google vision client answering from the scenarios of the fake meraki snapshots
+# latency is added once per request, errorRate fails single images, failureRate whole requests
+class FakeVisionClient:
+
+    def __init__(self, images, latency=0.3, errorRate=0.0, failureRate=0.0):
+        self.images = images
+        self.latency = latency
+        self.errorRate = errorRate
+        self.failureRate = failureRate
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def scenario(self, image):
+        if image.content:
+            return self.images.get(hashlib.sha256(image.content).hexdigest(), {})
+        return self.images.get(image.source.image_uri, {})
+
+    def annotate(self, image, featureTypes):
+        response = vision.AnnotateImageResponse()
+        if random.random() < self.errorRate:
+            response.error.message = 'Fake annotation error'
+            return response
+
+        scenario = self.scenario(image)
+        if vision.Feature.Type.LABEL_DETECTION in featureTypes:
+            response.label_annotations = [vision.EntityAnnotation(description=description, score=score)
+                                          for description, score in scenario.get('labels', [])]
+        if vision.Feature.Type.TEXT_DETECTION in featureTypes and scenario.get('text'):
+            # full text first, then one annotation per word, like google vision
+            response.text_annotations = [vision.EntityAnnotation(description=scenario['text'] + '\n')] + [
+                vision.EntityAnnotation(description=word) for word in scenario['text'].split()]
+        return response
+
+    def request(self, imageCount):
+        self.count('requests')
+        self.count('images', imageCount)
+        time.sleep(self.latency)
+        if random.random() < self.failureRate:
+            self.count('failures')
+            raise ServiceUnavailable('Fake google vision outage')
+
+    def batch_annotate_images(self, requests):
+        self.request(len(requests))
+        return vision.BatchAnnotateImagesResponse(responses=[
+            self.annotate(request.image, {feature.type_ for feature in request.features}) for request in requests])
+
+    def text_detection(self, image):
+        self.request(1)
+        return self.annotate(image, {vision.Feature.Type.TEXT_DETECTION})
+
+    def label_detection(self, image):
+        self.request(1)
+        return self.annotate(image, {vision.Feature.Type.LABEL_DETECTION})
@@ -0,0 +1,107 @@
+# in-memory stand-in for json-server: /order and /car_event with the query parameters used by functions.py
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import threading
+import json
+
+
+# value of a field as written in a query string
+def queryValue(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+class FakeJsonServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # persistPath: like json-server, the whole database is written to this file after each change
+    def __init__(self, db, port=0, persistPath=None):
+        super().__init__(('127.0.0.1', port), FakeJsonHandler)
+        self.db = db
+        self.persistPath = persistPath
+        self.lock = threading.Lock()
+        self.requestCount = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def persist(self):
+        if self.persistPath:
+            with open(self.persistPath, 'w') as f:
+                json.dump(self.db, f, indent=2)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FakeJsonHandler(BaseHTTPRequestHandler):
+    # keep-alive, like json-server
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def readBody(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        values = parse_qs(url.query)
+        query = {k: v[0] for k, v in values.items()}
+        table = url.path.strip('/')
+        with self.server.lock:
+            self.server.requestCount += 1
+            rows = list(self.server.db.get(table, []))
+        if table not in self.server.db:
+            return self.reply(404, {})
+
+        # a repeated parameter matches any of its values, field_gte and field_lte select a range
+        for key, value in values.items():
+            if key.endswith('_gte'):
+                rows = [row for row in rows if row.get(key[:-4]) is not None and row[key[:-4]] >= value[0]]
+            elif key.endswith('_lte'):
+                rows = [row for row in rows if row.get(key[:-4]) is not None and row[key[:-4]] <= value[0]]
+            elif not key.startswith('_'):
+                rows = [row for row in rows if queryValue(row.get(key)) in value]
+        if '_sort' in query:
+            rows.sort(key=lambda row: row.get(query['_sort']),
+                      reverse=query.get('_order') == 'desc')
+        if '_limit' in query:
+            rows = rows[:int(query['_limit'])]
+        self.reply(200, rows)
+
+    def do_POST(self):
+        table = urlparse(self.path).path.strip('/')
+        row = self.readBody()
+        with self.server.lock:
+            self.server.requestCount += 1
+            rows = self.server.db.setdefault(table, [])
+            row['id'] = max([r['id'] for r in rows], default=0) + 1
+            rows.append(row)
+            self.server.persist()
+        self.reply(201, row)
+
+    def do_PATCH(self):
+        table, rowId = urlparse(self.path).path.strip('/').split('/')
+        fields = self.readBody()
+        with self.server.lock:
+            self.server.requestCount += 1
+            for row in self.server.db.get(table, []):
+                if str(row['id']) == rowId:
+                    row.update(fields)
+                    self.server.persist()
+                    return self.reply(200, row)
+        self.reply(404, {})
@@ -0,0 +1,254 @@
+# load test of flask_server.py without cloud accounts: Meraki, Google Vision, Webex and json-server are local stand-ins
+# fires motion_alert webhooks at a fixed rate across many cameras, then reports the latency percentiles,
+# the dropped alerts and the API calls per alert
+# usage: python benchmarks/load_test.py --rate 2 --duration 60 --cameras 30 --schedule 3,5,7 --settle 1,6
+import os
+import sys
+import time
+import random
+import string
+import logging
+import argparse
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from fake_json_server import FakeJsonServer  # noqa: E402
+from fake_cloud import FakeMeraki, FakeWebex, FakeVisionClient  # noqa: E402
+
+SHARED_KEY = 'load-test'
+
+
+def randomPlate():
+    return '{}{}{} {}'.format(random.choice(string.ascii_uppercase), random.choice(string.ascii_uppercase),
+                              random.randint(10, 99), ''.join(random.choices(string.ascii_uppercase, k=3)))
+
+
+def isoTime(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def percentile(samples, p):
+    if not samples:
+        return float('nan')
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def report(name, samples):
+    print('{:<24} n {:5d}   p50 {:7.2f} s   p95 {:7.2f} s   p99 {:7.2f} s'.format(
+        name, len(samples), percentile(samples, 0.5), percentile(samples, 0.95), percentile(samples, 0.99)))
+
+
+class LoadTest:
+
+    def __init__(self, args):
+        self.args = args
+        self.alerts = {}
+        self.activeAlerts = {}
+        self.lock = threading.Lock()
+        self.poster = ThreadPoolExecutor(max_workers=16)
+        self.session = requests.Session()
+
+        self.plates = [randomPlate() for i in range(args.orders)]
+        now = isoTime(datetime.utcnow())
+        self.db = FakeJsonServer({'order': [
+            {'id': i + 1, 'customer': 'Customer %d' % (i + 1), 'menu': 'Fries', 'qty': 1,
+             'car_plate': plate, 'time': now, 'serviced': False} for i, plate in enumerate(self.plates)],
+            'car_event': []}).start()
+        # seconds after the motion before the plate can be read, per camera
+        settleMin, settleMax = [float(value) for value in args.settle.split(',')]
+        self.settle = {}
+        self.settleRange = (settleMin, settleMax)
+        self.meraki = FakeMeraki(self.scenarioFor, readyDelay=args.ready_delay).start()
+        self.webex = FakeWebex(self.onMessage).start()
+        self.vision = FakeVisionClient(self.meraki.images, latency=args.vision_latency,
+                                       errorRate=args.vision_errors, failureRate=args.vision_failures)
+
+    # the flask server modules read their configuration when imported
+    def startServer(self, tmp):
+        os.environ.update({
+            'DB_HOST': self.db.url, 'DB_BACKEND': 'json-server',
+            'MERAKI_BASE_URL': self.meraki.url, 'MV_API_KEY': 'load-test', 'MV_SHARED_KEY': SHARED_KEY,
+            'WEBEX_BASE_URL': self.webex.url + '/v1/', 'WEBEX_TOKEN': 'load-test', 'WEBEX_ROOM_ID': 'load-test',
+            'WEBEX_OUTBOX': os.path.join(tmp, 'webex_outbox.db'), 'VISION_CACHE_DB': '',
+            'ARCHIVE_AFTER_DAYS': '0'})
+        from google.cloud import vision
+        vision.ImageAnnotatorClient = lambda *args, **kwargs: self.vision
+
+        import flask_server
+        flask_server.startBackground()
+        flask_server.snapshotTiming.defaultSchedule = [float(delay) for delay in self.args.schedule.split(',')]
+
+        # alert processing wrapped to know which alert each snapshot, and so each notification, belongs to
+        timedMotionAlert = flask_server.timedMotionAlert
+
+        # the alerts coalesced into the job are done with it
+        def trackedMotionAlert(deviceSerial, deviceName, occurredAt, group):
+            alert = self.alerts[(deviceSerial, occurredAt)]
+            with self.lock:
+                self.activeAlerts[deviceSerial] = alert
+            try:
+                timedMotionAlert(deviceSerial, deviceName, occurredAt, group)
+            finally:
+                finishedAt = time.monotonic()
+                for joined in group.alerts:
+                    self.alerts[(deviceSerial, joined)]['finishedAt'] = finishedAt
+        flask_server.timedMotionAlert = trackedMotionAlert
+
+        self.server = flask_server
+        self.httpd = make_server('127.0.0.1', 0, flask_server.mainApp, threaded=True)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_port
+
+    # what the snapshots of an alert show: a car with an ordered plate, an unknown plate, no readable plate, or no car
+    def newScenario(self):
+        roll = random.random()
+        if roll < self.args.match:
+            return 'match', {'labels': [('Car', 0.95), ('Vehicle', 0.9)], 'text': random.choice(self.plates)}
+        roll -= self.args.match
+        if roll < self.args.unknown:
+            return 'unknown', {'labels': [('Car', 0.95), ('Vehicle', 0.9)], 'text': randomPlate()}
+        roll -= self.args.unknown
+        if roll < self.args.no_plate:
+            return 'no_plate', {'labels': [('Car', 0.9)], 'text': ''}
+        return 'no_vehicle', {'labels': [('Tree', 0.9), ('Shadow', 0.7)], 'text': ''}
+
+    # before the bay settled, the car is seen without a readable plate
+    def scenarioFor(self, serial, timestamp):
+        with self.lock:
+            alert = self.activeAlerts[serial]
+            settle = self.settle.setdefault(serial, random.uniform(*self.settleRange))
+        delay = (datetime.fromisoformat(timestamp.rstrip('Z')) -
+                 datetime.fromisoformat(alert['occurredAt'].rstrip('Z'))).total_seconds()
+        if alert['scenario'].get('text') and delay < settle:
+            return {'labels': alert['scenario']['labels'], 'text': ''}, alert
+        return alert['scenario'], alert
+
+    def onMessage(self, message, receivedAt):
+        alert = self.meraki.tagOf(str(message))
+        if alert is None:
+            return
+        alert.setdefault('notifiedAt', receivedAt)
+
+        # press a card button on part of the arrived customer cards
+        orderId = alert.get('orderId')
+        if alert['kind'] == 'match' and random.random() < self.args.press:
+            inputs = {'orderId': str(orderId), 'type': 'orderProcessed'}
+            actionId = self.webex.pressButton(message['id'], inputs)
+            self.poster.submit(self.post, '/card_action', {
+                'id': 'webhook', 'name': 'load-test', 'resource': 'attachmentActions', 'event': 'created',
+                'data': {'id': actionId, 'messageId': message['id']}})
+
+    def post(self, path, payload):
+        try:
+            return self.session.post(self.url + path, json=payload, timeout=10).status_code
+        except requests.RequestException:
+            return None
+
+    def fireAlert(self, serial):
+        kind, scenario = self.newScenario()
+        occurredAt = isoTime(datetime.utcnow())
+        alert = {'serial': serial, 'kind': kind, 'scenario': scenario, 'sentAt': time.monotonic(),
+                 'occurredAt': occurredAt}
+        if kind == 'match':
+            alert['orderId'] = self.plates.index(scenario['text']) + 1
+        self.alerts[(serial, occurredAt)] = alert
+        alert['status'] = self.post('/webhook', {
+            'sharedSecret': SHARED_KEY, 'alertTypeId': 'motion_alert', 'deviceSerial': serial,
+            'deviceName': 'Camera ' + serial, 'occurredAt': occurredAt})
+
+    def run(self):
+        cameras = ['Q2LT-%04d-LOAD' % i for i in range(self.args.cameras)]
+        start = time.monotonic()
+        futures = []
+        for i in range(int(self.args.rate * self.args.duration)):
+            # fixed rate, a slow webhook answer does not delay the next alert
+            time.sleep(max(0, start + i / self.args.rate - time.monotonic()))
+            futures.append(self.poster.submit(self.fireAlert, random.choice(cameras)))
+        for future in futures:
+            future.result()
+
+        # wait for the accepted alerts and their notifications
+        deadline = time.monotonic() + self.args.drain
+        while time.monotonic() < deadline:
+            pending = [alert for alert in self.alerts.values()
+                       if alert['status'] == 202 and 'finishedAt' not in alert]
+            if not pending and self.server.webexSender.depth() == 0 and self.server.jobQueue.depth() == 0:
+                break
+            time.sleep(0.2)
+        time.sleep(0.5)
+        return time.monotonic() - start
+
+    def report(self, elapsed):
+        alerts = list(self.alerts.values())
+        accepted = [alert for alert in alerts if alert['status'] == 202]
+        finished = [alert for alert in accepted if 'finishedAt' in alert]
+        rejected = len([alert for alert in alerts if alert['status'] == 503])
+        failed = len(alerts) - len(accepted) - rejected
+
+        outcomes = {}
+        for (camera, outcome), count in self.server.alertOutcomes.values.items():
+            outcomes[outcome] = outcomes.get(outcome, 0) + count
+
+        # dropped: refused by the webhook, or lost by an exception while processing
+        print('alerts sent {}   accepted {}   dropped {} (503: {}, failed: {}, job errors: {})   unfinished {}   '
+              'in {:.1f} s'.format(len(alerts), len(accepted), len(alerts) - len(accepted) + outcomes.get('error', 0),
+                                   rejected, failed, outcomes.get('error', 0), len(accepted) - len(finished), elapsed))
+        report('end-to-end (processed)', [alert['finishedAt'] - alert['sentAt'] for alert in finished])
+        report('first notification', [alert['notifiedAt'] - alert['sentAt']
+                                      for alert in accepted if 'notifiedAt' in alert])
+        for kind in ['match', 'unknown', 'no_plate', 'no_vehicle']:
+            report('  ' + kind, [alert['finishedAt'] - alert['sentAt'] for alert in finished if alert['kind'] == kind])
+
+        print('coalesced alerts', self.server.alertCoalescer.stats()['coalesced'])
+        schedules = [camera['schedule'] for camera in self.server.snapshotTiming.stats().values()]
+        print('snapshot schedules learned', len([schedule for schedule in schedules
+                                                 if schedule and schedule != self.server.snapshotTiming.defaultSchedule]),
+              'of', len(schedules))
+        print('outcomes', dict(sorted(outcomes.items())))
+
+        calls = dict(self.meraki.counts)
+        calls.update({'vision' + name.capitalize(): count for name, count in self.vision.counts.items()})
+        calls.update(self.webex.counts)
+        calls['dbRequests'] = self.db.requestCount
+        print('API calls per accepted alert')
+        for name, count in sorted(calls.items()):
+            print('  {:<22} {:7.2f}   ({} total)'.format(name, count / max(len(accepted), 1), count))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=float, default=1, help='motion alerts per second')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of alerts')
+    parser.add_argument('--cameras', type=int, default=20)
+    parser.add_argument('--orders', type=int, default=200, help='open orders in the order DB')
+    parser.add_argument('--schedule', default='12,16,20', help='snapshot times of the cameras without history')
+    parser.add_argument('--settle', default='0,0', help='min,max seconds before the plate of a bay can be read')
+    parser.add_argument('--ready-delay', type=float, default=2, help='seconds before a snapshot can be downloaded')
+    parser.add_argument('--vision-latency', type=float, default=0.4, help='seconds per google vision request')
+    parser.add_argument('--vision-errors', type=float, default=0.02, help='share of images annotated with an error')
+    parser.add_argument('--vision-failures', type=float, default=0.0, help='share of failed google vision requests')
+    parser.add_argument('--match', type=float, default=0.6, help='share of alerts with an ordered plate')
+    parser.add_argument('--unknown', type=float, default=0.2, help='share of alerts with an unknown plate')
+    parser.add_argument('--no-plate', type=float, default=0.1, help='share of alerts without readable plate')
+    parser.add_argument('--press', type=float, default=0.5, help='share of arrived cards with a button press')
+    parser.add_argument('--drain', type=float, default=120, help='max seconds to wait for the last alerts')
+    parser.add_argument('--verbose', action='store_true', help='keep the output of the flask server')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    loadTest = LoadTest(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        # the flask server prints every step, hidden unless --verbose
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            loadTest.startServer(tmp)
+            elapsed = loadTest.run()
+        loadTest.report(elapsed)
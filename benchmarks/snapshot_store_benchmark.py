@@ -0,0 +1,77 @@
+# snapshot archive: ms per stored snapshot (new, already stored, streamed), per index entry, per lookup and per read
+# usage: python benchmarks/snapshot_store_benchmark.py [snapshots] [snapshot KB]
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from snapshot_store import SnapshotStore  # noqa: E402
+
+
+def timed(function, items):
+    timings = []
+    results = []
+    for item in items:
+        start = time.perf_counter()
+        results.append(function(item))
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, results
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    print('{:<36} {:>8.3f} ms   p95 {:>8.3f} ms'.format(
+        name, statistics.mean(timings), timings[int(len(timings) * 0.95)]))
+
+
+def chunked(content, size=64 * 1024):
+    for i in range(0, len(content), size):
+        yield content[i:i + size]
+
+
+def readAll(path):
+    with open(path, 'rb') as f:
+        return len(f.read())
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    size = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 150 * 1024
+    directory = tempfile.mkdtemp()
+    try:
+        store = SnapshotStore(directory)
+        snapshots = [os.urandom(size) for _ in range(count)]
+        print('{} snapshots of {} KB\n'.format(count, size // 1024))
+
+        timings, digests = timed(store.put, snapshots)
+        report('put, new snapshot', timings)
+        report('put, already stored', timed(store.put, snapshots[:count // 4])[0])
+        report('putStream, new, 64 KB chunks', timed(lambda content: store.putStream(chunked(content)),
+                                                     [os.urandom(size) for _ in range(count // 4)])[0])
+
+        cameras = ['Q2XX-%04d' % i for i in range(20)]
+        plates = ['B %04d XYZ' % i for i in range(count)]
+        tags = [(digest, random.choice(cameras), '2021-06-%02dT%02d:%02d:00Z' % (1 + i % 28, i % 24, i % 60),
+                 plates[i], i) for i, digest in enumerate(digests)]
+        report('tag', timed(lambda tag: store.tag(*tag), tags)[0])
+        report('find by plate', timed(lambda plate: store.find(plate=plate), random.sample(plates, 200))[0])
+        report('find by order id', timed(lambda orderId: store.find(orderId=orderId),
+                                         random.sample(range(count), 200))[0])
+
+        def readMapped(digest):
+            with store.open(digest) as content:
+                return content[:2]
+        sample = random.sample(digests[count // 4:], min(200, count - count // 4))
+        report('open (mmap) and read the header', timed(readMapped, sample)[0])
+        report('read the whole file', timed(lambda digest: readAll(store.path(digest)), sample)[0])
+        print('\n', store.stats())
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# latency of the storage operations: JSON-server vs SQLite
+# usage: python benchmarks/storage_benchmark.py [operations] [DB_HOST]
+# without DB_HOST, the in-memory json-server stand-in is used, rewriting its whole file on each write like json-server
+import os
+import sys
+import json
+import time
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from db_client import DBClient  # noqa: E402
+from storage import JsonServerStore, SqliteStore  # noqa: E402
+from fake_json_server import FakeJsonServer  # noqa: E402
+
+
+def timeCalls(func, count):
+    samples = []
+    for i in range(count):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def run(name, store, count):
+    event = {'plate': 'MY70 BMW', 'time': '2021-04-23T08:39:46Z', 'location': 'MV12'}
+    operations = [
+        ('addCarEvent', lambda i: store.addCarEvent(dict(event))),
+        ('latestOrder', lambda i: store.latestOrder('MY70 BMW')),
+        ('setServiced', lambda i: store.setServiced('2', i % 2 == 0)),
+        ('openOrders', lambda i: store.openOrders('2021-01-01T00:00:00Z')),
+    ]
+    for operation, func in operations:
+        samples = sorted(timeCalls(func, count))
+        print('{:<12} {:<12} mean {:7.3f} ms   p50 {:7.3f} ms   p99 {:7.3f} ms'.format(
+            name, operation, statistics.mean(samples), samples[len(samples) // 2],
+            samples[int(len(samples) * 0.99) - 1]))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    with open(os.path.join(ROOT, 'db_server.json')) as f:
+        data = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if len(sys.argv) > 2:
+            host = sys.argv[2]
+        else:
+            host = FakeJsonServer(json.loads(json.dumps(data)),
+                                  persistPath=os.path.join(tmp, 'db.json')).start().url
+        run('json-server', JsonServerStore(DBClient(host)), count)
+
+        sqliteStore = SqliteStore(os.path.join(tmp, 'db.sqlite'))
+        sqliteStore.importJson(data)
+        run('sqlite', sqliteStore, count)
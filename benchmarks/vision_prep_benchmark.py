@@ -0,0 +1,100 @@
+# bytes sent to google vision and preparation time per snapshot: as downloaded, downscaled, cropped to the bay
+# uses the jpeg files given on the command line, or synthetic 1080p frames of a bay with a car and its plate
+# usage: python benchmarks/vision_prep_benchmark.py [frames or snapshot.jpg ...] [--uplink MBIT]
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vision_prep import VisionPrep  # noqa: E402
+
+# region of the synthetic frames where the car stops
+BAY_REGION = [0.2, 0.35, 0.8, 1.0]
+
+
+# camera frame of the bay: background, a car with its plate, sensor noise
+def syntheticFrame(seed, size=(1920, 1080)):
+    rng = random.Random(seed)
+    width, height = size
+    gradient = np.linspace(60, 200, height, dtype=np.float32)[:, None, None]
+    pixels = np.broadcast_to(gradient, (height, width, 3)).copy()
+    image = Image.fromarray(pixels.astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for _ in range(30):
+        x, y = rng.randrange(width), rng.randrange(height // 3)
+        draw.rectangle([x, y, x + rng.randrange(20, 200), y + rng.randrange(10, 120)],
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+
+    left, top = int(width * (0.3 + rng.random() * 0.1)), int(height * 0.45)
+    draw.rectangle([left, top, left + width * 0.35, height * 0.95], fill=tuple(rng.randrange(256) for _ in range(3)))
+    plateLeft, plateTop = left + int(width * 0.12), int(height * 0.82)
+    draw.rectangle([plateLeft, plateTop, plateLeft + 220, plateTop + 50], fill=(20, 20, 20))
+    draw.text((plateLeft + 15, plateTop + 15), 'B %04d XYZ' % rng.randrange(10000), fill=(240, 240, 240))
+
+    noisy = np.asarray(image, dtype=np.int16) + np.random.default_rng(seed).normal(0, 6, (height, width, 3))
+    output = io.BytesIO()
+    Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8)).save(output, format='JPEG', quality=92)
+    return output.getvalue()
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def run(name, prep, snapshots, uplink):
+    sizes, timings = [], []
+    for content in snapshots:
+        start = time.perf_counter()
+        prepared = prep.prepare('Q2XX-BENCH', content) if prep is not None else content
+        timings.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(prepared))
+    meanBytes = statistics.mean(sizes)
+    print('{:<34} {:>9.0f} {:>9.0f} {:>8.2f} {:>8.2f} {:>11.1f}'.format(
+        name, meanBytes, max(sizes), statistics.mean(timings), percentile(timings, 0.95),
+        meanBytes * 8 / (uplink * 1e6) * 1000))
+    return prepared
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('snapshots', nargs='*', help='jpeg files, synthetic frames when empty')
+    parser.add_argument('--frames', type=int, default=20, help='synthetic frames')
+    parser.add_argument('--uplink', type=float, default=10, help='upload bandwidth in Mbit/s for the upload time')
+    parser.add_argument('--save', help='directory where the last prepared image of each setting is written')
+    args = parser.parse_args()
+
+    if args.snapshots:
+        snapshots = [open(path, 'rb').read() for path in args.snapshots]
+    else:
+        snapshots = [syntheticFrame(seed) for seed in range(args.frames)]
+    print('{} snapshots of {}x{}\n'.format(len(snapshots), *Image.open(io.BytesIO(snapshots[0])).size))
+
+    settings = [
+        ('as downloaded', None),
+        ('budget 500 KB', VisionPrep(maxSide=10000, maxBytes=500000)),
+        ('1600 px, 500 KB (default)', VisionPrep()),
+        ('1024 px, 200 KB', VisionPrep(maxSide=1024, maxBytes=200000)),
+        ('bay crop, 1024 px, 150 KB', VisionPrep({'Q2XX-BENCH': BAY_REGION}, maxSide=1024, maxBytes=150000)),
+        ('bay crop, 1024 px, 150 KB, gray', VisionPrep({'Q2XX-BENCH': BAY_REGION}, maxSide=1024,
+                                                       maxBytes=150000, grayscale=True)),
+    ]
+    print('{:<34} {:>9} {:>9} {:>8} {:>8} {:>11}'.format(
+        'setting', 'bytes', 'max', 'ms', 'p95 ms', 'upload ms'))
+    for name, prep in settings:
+        prepared = run(name, prep, snapshots, args.uplink)
+        if args.save:
+            os.makedirs(args.save, exist_ok=True)
+            with open(os.path.join(args.save, name.replace(' ', '_').replace(',', '') + '.jpg'), 'wb') as f:
+                f.write(prepared)
+
+
+if __name__ == '__main__':
+    main()
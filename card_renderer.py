@@ -0,0 +1,207 @@
+# adaptive card rendering: the card template is compiled once, each notification only fills in its slots
+import json
+import re
+
+# a slot is a JSON string holding only {{name}}
+SLOT = re.compile(r'"\{\{(\w+)\}\}"')
+
+
+class CardTemplate:
+
+    # template: JSON-serializable payload with slot strings, slotTypes: {name: type the value is converted to}
+    def __init__(self, template, slotTypes):
+        text = json.dumps(template, separators=(',', ':'))
+        parts = SLOT.split(text)
+        self.literals = tuple(parts[0::2])
+        self.slots = tuple(parts[1::2])
+        self.slotTypes = dict(slotTypes)
+
+        missing = set(self.slots) - set(self.slotTypes)
+        if missing:
+            raise ValueError('Card template slots without a type: {}'.format(sorted(missing)))
+
+    # JSON text of the payload with the given slot values, nothing shared between two calls
+    def render(self, **values):
+        out = [self.literals[0]]
+        for name, literal in zip(self.slots, self.literals[1:]):
+            out.append(json.dumps(self.slotTypes[name](values[name])))
+            out.append(literal)
+        return ''.join(out)
+
+    def renderBytes(self, **values):
+        return self.render(**values).encode()
+
+
+# webex card payload, the {{slot}} strings are filled in by the card renderer
+CARD_CONTENT = {
+    "type": "AdaptiveCard",
+    "body": [
+        {
+            "type": "ColumnSet",
+            "columns": [
+                {
+                    "type": "Column",
+                    "items": [
+                        {
+                            "type": "Image",
+                            "url": "{{iconUrl}}",
+                            "size": "Medium",
+                            "height": "50px",
+                            "backgroundColor": "White"
+                        }
+                    ],
+                    "width": "auto"
+                },
+                {
+                    "type": "Column",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "Meraki Car Plate Detection",
+                            "color": "Good",
+                            "size": "Small",
+                            "weight": "Lighter"
+                        },
+                        {
+                            "type": "TextBlock",
+                            "text": "{{title}}",
+                            "wrap": True,
+                            "color": "{{titleColor}}",
+                            "size": "Medium",
+                            "spacing": "Small",
+                            "weight": "Bolder"
+                        }
+                    ],
+                    "width": "stretch"
+                }
+            ]
+        },
+        {
+            "type": "ColumnSet",
+            "columns": [
+                {
+                    "type": "Column",
+                    "width": 35,
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "Car plate:",
+                            "color": "Light"
+                        },
+                        {
+                            "type": "TextBlock",
+                            "text": "Name:",
+                            "weight": "Lighter",
+                            "color": "Light",
+                            "spacing": "Small"
+                        },
+                        {
+                            "type": "TextBlock",
+                            "text": "Menu / Qty:",
+                            "weight": "Lighter",
+                            "color": "Light",
+                            "spacing": "Small"
+                        },
+                        {
+                            "type": "TextBlock",
+                            "text": "Date order / ID:",
+                            "weight": "Lighter",
+                            "color": "Light",
+                            "spacing": "Small"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": 65,
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "{{plate}}",
+                            "color": "Light"
+                        },
+                        {
+                            "type": "TextBlock",
+                            "text": "{{customer}}",
+                            "color": "Light",
+                            "weight": "Lighter",
+                            "spacing": "Small"
+                        },
+                        {
+                            "type": "TextBlock",
+                            "text": "{{menu}}",
+                            "weight": "Lighter",
+                            "color": "Light",
+                            "spacing": "Small"
+                        },
+                        {
+                            "type": "TextBlock",
+                            "text": "{{orderTime}}",
+                            "weight": "Lighter",
+                            "color": "Light",
+                            "spacing": "Small"
+                        }
+                    ]
+                }
+            ],
+            "spacing": "Padding",
+            "horizontalAlignment": "Center"
+        },
+        {
+            "type": "Image",
+            "url": "{{imageUrl}}"
+        },
+        {
+            "type": "ActionSet",
+            "actions": [
+                {
+                    "type": "Action.Submit",
+                    "title": "Process Order",
+                    "data": {
+                        "orderId": "{{orderId}}",
+                        "type": "orderProcessed"
+                    },
+                    "style": "positive"
+                },
+                {
+                    "type": "Action.Submit",
+                    "title": "Discard Order",
+                    "data": {
+                        "orderId": "{{orderId}}",
+                        "type": "orderDiscarded"
+                    },
+                    "style": "positive"
+                }
+            ],
+            "spacing": "None"
+        }
+    ],
+    "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
+    "version": "1.2"
+}
+
+
+# webex message carrying the card, as given to webexAPI.messages.create
+CARD_MESSAGE = {
+    "roomId": "{{roomId}}",
+    "text": "If you see this your client cannot render cards",
+    "attachments": [{
+        "contentType": "application/vnd.microsoft.card.adaptive",
+        "content": CARD_CONTENT
+    }]
+}
+
+CARD_SLOTS = {
+    'roomId': str,
+    'iconUrl': str,
+    'title': str,
+    'titleColor': str,
+    'plate': str,
+    'customer': str,
+    'menu': str,
+    'orderTime': str,
+    'imageUrl': str,
+    'orderId': str
+}
+
+CARD_TEMPLATE = CardTemplate(CARD_MESSAGE, CARD_SLOTS)
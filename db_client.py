@@ -0,0 +1,65 @@
+# HTTP client for the JSON-server database, keeping the connections alive between calls
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class DBClient:
+
+    def __init__(self, host, poolSize=10, timeout=5, retries=3):
+        self.host = host
+        self.timeout = timeout
+
+        # connection errors are retried for every method, HTTP errors only for idempotent ones
+        retry = Retry(total=retries, backoff_factor=0.2,
+                      status_forcelist=[502, 503, 504],
+                      allowed_methods=frozenset(['GET', 'PATCH']))
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=poolSize, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    def request(self, method, path, params=None, payload=None):
+        return self.session.request(method, self.host + path, params=params,
+                                    json=payload, timeout=self.timeout)
+
+    # store a car event
+    def postCarEvent(self, event):
+        return self.request('POST', '/car_event', payload=event)
+
+    # most recent order of a car plate
+    def getLatestOrder(self, plate):
+        params = {'car_plate': plate, '_sort': 'id',
+                  '_order': 'desc', '_limit': 1}
+        return self.request('GET', '/order', params=params)
+
+    # orders of several car plates, most recent first, JSON-server matches any of the repeated car_plate values
+    def getLatestOrders(self, plates):
+        params = [('car_plate', plate) for plate in plates] + [('_sort', 'id'), ('_order', 'desc')]
+        return self.request('GET', '/order', params=params)
+
+    # orders placed since the given time (ISO 8601, UTC), serviced or not: json-server cannot select
+    # the orders without serviced field, the caller filters them
+    def getOrdersSince(self, time):
+        return self.request('GET', '/order', params={'time_gte': time})
+
+    # most recent car events
+    def getRecentCarEvents(self, limit):
+        params = {'_sort': 'id', '_order': 'desc', '_limit': limit}
+        return self.request('GET', '/car_event', params=params)
+
+    # car events recorded at or before the given time (ISO 8601, UTC)
+    def getCarEventsBefore(self, time):
+        return self.request('GET', '/car_event', params={'time_lte': time})
+
+    def deleteCarEvent(self, eventId):
+        return self.request('DELETE', '/car_event/' + str(eventId))
+
+    def patchOrder(self, orderId, fields):
+        return self.request('PATCH', '/order/' + str(orderId), payload=fields)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,105 @@
+# car event history archive: events older than the retention age leave the live store
+# for daily gzip JSONL segments, with a SQLite index telling which days hold a plate or location
+from datetime import datetime, timedelta
+from plate_matching import normalizePlate
+import threading
+import sqlite3
+import gzip
+import json
+import os
+
+
+class EventArchive:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.index = sqlite3.connect(os.path.join(directory, 'index.sqlite'),
+                                     check_same_thread=False)
+        self.index.executescript('''
+            CREATE TABLE IF NOT EXISTS segment_key (
+                day TEXT, plate TEXT, location TEXT, events INTEGER,
+                PRIMARY KEY (day, plate, location));
+            CREATE INDEX IF NOT EXISTS segment_key_plate ON segment_key (plate, day);
+            CREATE INDEX IF NOT EXISTS segment_key_location ON segment_key (location, day);
+        ''')
+
+    def segmentPath(self, day):
+        return os.path.join(self.directory, 'car_event-{}.jsonl.gz'.format(day))
+
+    # append the events to the segment of their day, a new gzip member is added on each call
+    def archive(self, events):
+        days = {}
+        for event in events:
+            days.setdefault(event['time'][:10], []).append(event)
+
+        with self.lock:
+            for day, dayEvents in days.items():
+                with gzip.open(self.segmentPath(day), 'at') as f:
+                    for event in dayEvents:
+                        f.write(json.dumps(event) + '\n')
+
+                keys = {}
+                for event in dayEvents:
+                    key = (day, normalizePlate(event.get('plate') or ''), event.get('location'))
+                    keys[key] = keys.get(key, 0) + 1
+                with self.index:
+                    self.index.executemany(
+                        'INSERT INTO segment_key VALUES (?, ?, ?, ?) ON CONFLICT (day, plate, location) '
+                        'DO UPDATE SET events = events + excluded.events',
+                        [key + (count,) for key, count in keys.items()])
+        return len(events)
+
+    # archived events of a plate and/or location, only the segments of the matching days are read
+    def query(self, plate=None, location=None, since=None, until=None):
+        conditions, params = [], []
+        if plate is not None:
+            conditions.append('plate = ?')
+            params.append(normalizePlate(plate))
+        if location is not None:
+            conditions.append('location = ?')
+            params.append(location)
+        if since is not None:
+            conditions.append('day >= ?')
+            params.append(since[:10])
+        if until is not None:
+            conditions.append('day <= ?')
+            params.append(until[:10])
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        with self.lock:
+            days = [row[0] for row in self.index.execute(
+                'SELECT DISTINCT day FROM segment_key' + where + ' ORDER BY day', params)]
+
+        events = []
+        for day in days:
+            with gzip.open(self.segmentPath(day), 'rt') as f:
+                for line in f:
+                    event = json.loads(line)
+                    if plate is not None and normalizePlate(event.get('plate') or '') != normalizePlate(plate):
+                        continue
+                    if location is not None and event.get('location') != location:
+                        continue
+                    if since is not None and event['time'] < since:
+                        continue
+                    if until is not None and event['time'] > until:
+                        continue
+                    events.append(event)
+        return events
+
+
+# move the car events older than maxAgeDays from the store to the archive, then compact the store
+def rollOverEvents(store, archive, maxAgeDays):
+    cutoff = (datetime.utcnow() - timedelta(days=maxAgeDays)
+              ).strftime("%Y-%m-%dT%H:%M:%SZ")
+    events = store.carEventsBefore(cutoff)
+    if not events:
+        return 0
+
+    # archived first: if the deletion fails, the events are archived again on the next run rather than lost
+    archive.archive(events)
+    store.deleteCarEvents([event['id'] for event in events])
+    store.compact()
+    print('Archived {} car events older than {}'.format(len(events), cutoff))
+    return len(events)
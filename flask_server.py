@@ -3,131 +3,504 @@
 from flask import Flask, request, Response, abort
 import time
 import os
+import json
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 from functions import *
 from webexteamssdk import Webhook
+from job_queue import JobQueue, JobQueueFull
+from alert_coalescer import AlertCoalescer
+from motion_filter import MotionPrefilter
+from snapshot_dedupe import SnapshotDedupe
+from vision_prep import VisionPrep
+from plate_vision import annotateImages
+from order_index import orderTimestamp
 
 # search .env file and load environment variable
 load_dotenv()
 MV_SHARED_KEY = os.getenv('MV_SHARED_KEY')
+# secret of the ordering app, sent in the X-Shared-Secret header of /order_event
+ORDER_SHARED_KEY = os.getenv('ORDER_SHARED_KEY')
 
 # webex destination
 WEBEX_ROOM_ID = os.getenv('WEBEX_ROOM_ID')
 
-# snapshot timing in seconds
-waitTime = 12
-intervalTime = 4
-
-# boolean for filtering webhooks
-runScript = True
+# min confidence of the vehicle label before running the plate detection, empty to always run it in the same request
+VISION_OCR_MIN_SCORE = float(os.getenv('VISION_OCR_MIN_SCORE')) if os.getenv(
+    'VISION_OCR_MIN_SCORE') else None
+
+# local motion pre-filter before google vision: 'on' rejects the snapshots, 'log' only logs its decisions, 'off'
+# BAY_REGIONS restricts the comparison to the pickup bay of each camera, e.g. {"Q2XX-XXXX-XXXX": [0.2, 0.4, 0.8, 1.0]}
+MOTION_PREFILTER = os.getenv('MOTION_PREFILTER', 'log')
+motionPrefilter = MotionPrefilter(
+    regions=json.loads(os.getenv('BAY_REGIONS', '{}')),
+    pixelThreshold=int(os.getenv('PREFILTER_PIXEL_THRESHOLD', 30)),
+    minAreaRatio=float(os.getenv('PREFILTER_MIN_AREA', 0.03)),
+    minBlobRatio=float(os.getenv('PREFILTER_MIN_BLOB', 0.02)))
+
+# snapshots sent to google vision cropped to the VISION_REGIONS of their camera, downscaled and re-encoded
+# to VISION_MAX_BYTES, 'off' sends them as downloaded
+VISION_PREP = os.getenv('VISION_PREP', 'on')
+visionPrep = VisionPrep(
+    regions=json.loads(os.getenv('VISION_REGIONS', '{}')),
+    maxSide=int(os.getenv('VISION_MAX_SIDE', 1600)),
+    maxBytes=int(os.getenv('VISION_MAX_BYTES', 500000)),
+    grayscale=os.getenv('VISION_GRAYSCALE', 'off') == 'on')
+visionBytes = metrics.counter('plate_vision_upload_bytes_total', 'Bytes of the snapshots sent to Google Vision',
+                              ('camera',))
+
+# recent snapshot hashes per camera, a similar snapshot within SNAPSHOT_DEDUPE_WINDOW seconds is not processed again
+# only the plate region of the camera (VISION_REGIONS, else BAY_REGIONS) is hashed
+snapshotDedupe = SnapshotDedupe(
+    maxDistance=int(os.getenv('SNAPSHOT_DEDUPE_DISTANCE', 6)),
+    window=int(os.getenv('SNAPSHOT_DEDUPE_WINDOW', 300)),
+    regions=dict(motionPrefilter.regions, **visionPrep.regions))
+
+# motion alerts of a camera within ALERT_COALESCE_WINDOW seconds are processed as one arrival
+alertCoalescer = AlertCoalescer(window=float(os.getenv('ALERT_COALESCE_WINDOW', 30)))
+alertsCoalesced = metrics.counter('plate_alerts_coalesced_total', 'Motion alerts merged into the job of a previous one',
+                                  ('camera',))
+
+# speculative snapshots: every snapshot of the schedule is taken when its time comes, without waiting for the
+# analysis of the previous one, the earliest snapshot with a plate matching an order wins
+SNAPSHOT_SPECULATIVE = os.getenv('SNAPSHOT_SPECULATIVE', 'off')
+SNAPSHOT_WORKERS = int(os.getenv('SNAPSHOT_WORKERS', 8))
+wavePool = ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS, thread_name_prefix='wave')
+snapshotPool = ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS, thread_name_prefix='snapshot')
+
+# background workers processing the motion alerts
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', 6))
+MAX_PENDING_JOBS = int(os.getenv('MAX_PENDING_JOBS', 100))
+jobQueue = JobQueue(WORKER_COUNT, MAX_PENDING_JOBS)
+
+# card button presses have their own workers: a press is processed right away, however busy the cameras are
+CARD_ACTION_WORKERS = int(os.getenv('CARD_ACTION_WORKERS', 2))
+MAX_PENDING_CARD_ACTIONS = int(os.getenv('MAX_PENDING_CARD_ACTIONS', 50))
+cardActionQueue = JobQueue(CARD_ACTION_WORKERS, MAX_PENDING_CARD_ACTIONS)
+
+# order index loaded at startup, then refreshed every ORDER_INDEX_REFRESH seconds
+ORDER_INDEX_REFRESH = int(os.getenv('ORDER_INDEX_REFRESH', 300))
+
+# queue depths, read when /metrics is scraped
+metrics.gauge('plate_pending_jobs', 'Motion alerts queued or running', jobQueue.depth)
+metrics.gauge('card_action_pending_jobs', 'Card button presses queued or running', cardActionQueue.depth)
+metrics.gauge('webex_queue_depth', 'Webex messages waiting to be sent', webexSender.depth)
+metrics.gauge('car_event_buffer_depth', 'Car events waiting to be written',
+              lambda: carEventBuffer.stats()['depth'])
 
 # Flask server setup
 mainApp = Flask(__name__)
 mainApp.debug = True
 
 
+# image given to google vision: the prepared snapshot, or the url if the download failed
+def visionSource(deviceSerial, snapResponse):
+    if snapResponse['content'] is None:
+        return snapshotSource(snapResponse)
+    content = snapResponse['content']
+    if VISION_PREP != 'off':
+        with stageSeconds.time('prepare', deviceSerial):
+            content = visionPrep.prepare(deviceSerial, content)
+    visionBytes.inc(deviceSerial, amount=len(content))
+    return content
+
+
+# snapshots of the schedule taken one after another, until a plate matches an order
+# returns the result of the last snapshot, None if a snapshot was a duplicate
+def sequentialSnapshots(deviceSerial, occurredAt, attempts):
+    detectedPlate = []
+    readDelay = None
+
+    # take the snapshots of the schedule: retrieving snapshot, car plate, image labels
+    for i, attempt in enumerate(attempts):
+        print('---------HERE COMES SNAPSHOT LOOP #%d (%s)---------' %
+              (i, deviceSerial))
+        if i > 0:
+            snapshotRetries.inc(deviceSerial)
+            time.sleep(max(0, attempt['startAt'] - time.monotonic()))
+        snapTime = attempt['snapTime']
+        snapDelay = attempt['snapDelay']
+        # generate snapshot url
+        snapResponse = snapshotAndUri(
+            deviceSerial, occurredAt, snapTime)
+
+        # for testing without meraki camera
+        # snapResponse = {'url': ''}
+        # snapResponse['url'] = 'https://assets.publishing.service.gov.uk/government/uploads/system/uploads/image_data/file/110487/s960_960-green-number-plate.jpg'
+
+        # a snapshot looking like a recent one of the same camera was already processed
+        # with plates it was already notified, without plates its result is reused and the schedule goes on
+        snapHash, previous = None, None
+        if snapResponse['content'] is not None:
+            with stageSeconds.time('dedupe', deviceSerial):
+                snapHash, previous = snapshotDedupe.lookup(
+                    deviceSerial, snapResponse['content'], occurredAt)
+            if previous is not None and previous['plates'] != []:
+                print('Snapshot of {} matches a recent one, already notified = {}'.format(
+                    deviceSerial, previous['plates']))
+                return None
+
+        if previous is not None:
+            print('Snapshot of {} matches a recent one without plate, reusing its result'.format(deviceSerial))
+            annotation = previous
+        else:
+            # local pre-filter: skip google vision when nothing vehicle sized moved in the bay
+            if MOTION_PREFILTER != 'off' and snapResponse['content'] is not None:
+                with stageSeconds.time('prefilter', deviceSerial):
+                    prefilterResult = motionPrefilter.check(
+                        deviceSerial, snapResponse['content'])
+                if prefilterResult == False and MOTION_PREFILTER == 'on':
+                    filterResult = False
+                    continue
+
+            # filter the snapshot for vehicle and detect the car plate in a single vision request
+            source = visionSource(deviceSerial, snapResponse)
+            with stageSeconds.time('vision', deviceSerial):
+                try:
+                    annotation = annotateImages(
+                        [source], ocrMinScore=VISION_OCR_MIN_SCORE)[0]
+                except Exception:
+                    visionErrors.inc(deviceSerial)
+                    raise
+            # a failed analysis is not kept: the next snapshot looking the same is analyzed again
+            if annotation['error']:
+                visionErrors.inc(deviceSerial)
+            elif snapHash is not None:
+                snapshotDedupe.store(deviceSerial, snapHash, annotation, occurredAt)
+        filterResult = annotation['relevant']
+
+        # if there are relevant labels detected, check the plate detection
+        if filterResult == True:
+            detectedPlate = annotation['plates']
+
+            # if car plate is detected, check order information
+            if detectedPlate != []:
+                if readDelay is None:
+                    readDelay = snapDelay
+
+                # search the plate candidates in the order database at once
+                print('1st order check for breaking the loop:')
+                with stageSeconds.time('order', deviceSerial):
+                    searchOrders = getOrders(detectedPlate)
+
+                # if any candidate matches an order, break from the loop
+                if any(order != [] for order in searchOrders.values()):
+                    break
+                # if there is no order match, take the next snapshot of the schedule
+                else:
+                    continue
+
+            # if there is no car plate detected, take the next snapshot of the schedule
+            else:
+                continue
+
+        # if no relevant labels detected, take the next snapshot of the schedule
+        else:
+            continue
+
+    return {'filterResult': filterResult, 'detectedPlate': detectedPlate, 'snapResponse': snapResponse,
+            'snapTime': snapTime, 'readDelay': readDelay}
+
+
+# snapshots of the schedule taken as soon as their time comes, analyzed while the next ones are taken
+# the attempts due at the same time (e.g. after a long coalescing) form one wave: one google vision batch
+# returns the earliest snapshot whose plate matches an order, else the last analyzed one, None for a duplicate
+def speculativeSnapshots(deviceSerial, occurredAt, attempts):
+    cancelled = threading.Event()
+    waves = {}
+    launched = 0
+    try:
+        while True:
+            # launch the attempts whose snapshot time has come
+            due = []
+            while launched < len(attempts) and attempts[launched]['startAt'] <= time.monotonic():
+                due.append(launched)
+                launched += 1
+            if due:
+                if launched > 1:
+                    snapshotRetries.inc(deviceSerial, amount=len(due) - (due[0] == 0))
+                waves[wavePool.submit(analyzeWave, deviceSerial, occurredAt,
+                                      [attempts[i] for i in due], cancelled)] = due
+
+            result = pickSnapshot(attempts, launched)
+            if result is not None:
+                return result if result != 'duplicate' else None
+
+            # wait for a wave to end, or for the next snapshot time
+            timeout = max(0, attempts[launched]['startAt'] - time.monotonic()) if launched < len(attempts) else None
+            if not waves:
+                time.sleep(timeout)
+                continue
+            done, pending = wait(list(waves), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                for i in waves.pop(future):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print('Speculative snapshot of {} failed: {!r}'.format(deviceSerial, e))
+                        attempts[i]['error'] = e
+                    attempts[i]['done'] = True
+    finally:
+        # the snapshots still polled or waiting for google vision are not needed anymore
+        cancelled.set()
+
+
+# take the snapshots of the attempts in parallel, then analyze them in a single google vision batch
+def analyzeWave(deviceSerial, occurredAt, wave, cancelled):
+    snapResponses = list(snapshotPool.map(
+        lambda attempt: snapshotAndUri(deviceSerial, occurredAt, attempt['snapTime'], cancelled), wave))
+    if cancelled.is_set():
+        return
+
+    toAnnotate = []
+    for attempt, snapResponse in zip(wave, snapResponses):
+        attempt['snapResponse'] = snapResponse
+        attempt['snapHash'] = None
+        if snapResponse['content'] is not None:
+            with stageSeconds.time('dedupe', deviceSerial):
+                attempt['snapHash'], previous = snapshotDedupe.lookup(
+                    deviceSerial, snapResponse['content'], occurredAt)
+            if previous is not None and previous['plates'] != []:
+                attempt['duplicate'] = True
+                continue
+            if previous is not None:
+                attempt['annotation'] = previous
+                continue
+            if MOTION_PREFILTER != 'off':
+                with stageSeconds.time('prefilter', deviceSerial):
+                    prefilterResult = motionPrefilter.check(deviceSerial, snapResponse['content'])
+                if prefilterResult == False and MOTION_PREFILTER == 'on':
+                    attempt['annotation'] = {'relevant': False, 'plates': []}
+                    continue
+        toAnnotate.append(attempt)
+
+    if toAnnotate and not cancelled.is_set():
+        sources = [visionSource(deviceSerial, attempt['snapResponse']) for attempt in toAnnotate]
+        with stageSeconds.time('vision', deviceSerial):
+            try:
+                annotations = annotateImages(sources, ocrMinScore=VISION_OCR_MIN_SCORE)
+            except Exception:
+                visionErrors.inc(deviceSerial)
+                raise
+        for attempt, annotation in zip(toAnnotate, annotations):
+            if annotation['error']:
+                visionErrors.inc(deviceSerial)
+            elif attempt['snapHash'] is not None:
+                snapshotDedupe.store(deviceSerial, attempt['snapHash'], annotation, occurredAt)
+            attempt['annotation'] = annotation
+
+            # whether any plate candidate matches an order
+            attempt['searchOrder'] = False
+            if annotation['relevant'] and annotation['plates'] != []:
+                with stageSeconds.time('order', deviceSerial):
+                    searchOrders = getOrders(annotation['plates'])
+                attempt['searchOrder'] = any(order != [] for order in searchOrders.values())
+
+
+# result of the speculative snapshots once it is known, None while it depends on attempts still running
+# the earliest matching snapshot wins once all the earlier ones are analyzed
+def pickSnapshot(attempts, launched):
+    for attempt in attempts:
+        if not attempt.get('done'):
+            return None
+        if attempt.get('duplicate'):
+            print('Snapshot taken at {} matches a recent one'.format(attempt['snapTime']))
+            return 'duplicate'
+        if attempt.get('searchOrder'):
+            return snapshotResult(attempts, attempt)
+    if launched < len(attempts):
+        return None
+
+    # no match: like the sequential snapshots, the last analyzed snapshot decides
+    analyzed = [attempt for attempt in attempts if 'annotation' in attempt]
+    if not analyzed:
+        raise next(attempt['error'] for attempt in attempts if 'error' in attempt)
+    return snapshotResult(attempts, analyzed[-1])
+
+
+def snapshotResult(attempts, attempt):
+    reads = [other['snapDelay'] for other in attempts
+             if other.get('annotation', {}).get('relevant') and other['annotation']['plates'] != []]
+    return {'filterResult': attempt['annotation']['relevant'], 'detectedPlate': attempt['annotation']['plates'],
+            'snapResponse': attempt['snapResponse'], 'snapTime': attempt['snapTime'],
+            'readDelay': min(reads) if reads else None}
+
+
+# motion alert processing, run by the job queue outside of the request thread
+# group: the alerts of the camera coalesced into this job, see alert_coalescer
+def processMotionAlert(deviceSerial, deviceName, occurredAt, group):
+
+    # snapshot times of the camera, in seconds after the last motion, see snapshotTiming
+    schedule = snapshotTiming.schedule(deviceSerial)
+
+    # wait for the car to be parked until the first snapshot time
+    # alerts of the same camera coming in meanwhile join the group and push the snapshot back
+    with stageSeconds.time('wait', deviceSerial):
+        heldFor = alertCoalescer.hold(group, schedule[0])
+    heldAt = time.monotonic()
+    occurredAt = group.firstOccurredAt
+
+    # snapshot time, and seconds after the last motion, of each snapshot of the schedule
+    firstDelay = heldFor - (group.lastMotionAt - group.openedAt)
+    attempts = [{'snapTime': addSeconds(occurredAt, heldFor + delay - schedule[0]),
+                 'snapDelay': firstDelay + delay - schedule[0],
+                 'startAt': heldAt + delay - schedule[0]} for delay in schedule]
+
+    if SNAPSHOT_SPECULATIVE == 'on':
+        result = speculativeSnapshots(deviceSerial, occurredAt, attempts)
+    else:
+        result = sequentialSnapshots(deviceSerial, occurredAt, attempts)
+
+    # a snapshot looking like a recent one of the same camera (e.g. a car still parked in the bay) was already processed
+    if result is None:
+        alertOutcomes.inc(deviceSerial, 'duplicate')
+        return
+    filterResult = result['filterResult']
+    detectedPlate = result['detectedPlate']
+    snapResponse = result['snapResponse']
+    snapTime = result['snapTime']
+    readDelay = result['readDelay']
+
+    # delay of the first read plate, or no read for a vehicle, for the next snapshot times of the camera
+    if filterResult == True:
+        snapshotTiming.record(deviceSerial, readDelay)
+
+    # if there is relevant labels but car plate is not detected at all, send snapshot url to webex for manual check, using a dedicated space
+    if filterResult == True and detectedPlate == []:
+        with stageSeconds.time('webex_post', deviceSerial):
+            postCard_noPlate(snapResponse, WEBEX_ROOM_ID)
+        alertOutcomes.inc(deviceSerial, 'no_plate')
+        # car event without plate, keeping the unread outcome for the snapshot timing learned after a restart
+        with stageSeconds.time('car_to_db', deviceSerial):
+            carToDB(None, snapTime, deviceName, deviceSerial, None, outcome=True)
+        with stageSeconds.time('archive', deviceSerial):
+            archiveSnapshot(snapResponse, deviceSerial, snapTime)
+
+    # if there is relevant labels and a car plate is detected, store car event in database, then send webex notification
+    elif filterResult == True and detectedPlate != []:
+        # retrieve the orders again
+        print('2nd order check for webex payload:')
+        with stageSeconds.time('order', deviceSerial):
+            searchOrders = getOrders(detectedPlate)
+
+        for plate in detectedPlate:
+            # store car event to database, the read delay on the first plate only
+            with stageSeconds.time('car_to_db', deviceSerial):
+                carToDB(plate, snapTime, deviceName, deviceSerial, readDelay, outcome=plate == detectedPlate[0])
+
+            searchOrder = searchOrders[plate]
+
+            # post to webex. the message will be different based on whether a plate match an order or not
+            with stageSeconds.time('webex_post', deviceSerial):
+                postCard_plateDetected(
+                    snapResponse, searchOrder, plate, WEBEX_ROOM_ID)
+            alertOutcomes.inc(deviceSerial, 'matched' if searchOrder != [] else 'no_match')
+
+        # the snapshot is kept once, under each plate and its order
+        with stageSeconds.time('archive', deviceSerial):
+            archiveSnapshot(snapResponse, deviceSerial, snapTime,
+                            [(plate, searchOrders[plate]['id'] if searchOrders[plate] != [] else None)
+                             for plate in detectedPlate])
+
+    # if no relevant labels detected
+    elif filterResult == False:
+        print(
+            "Invalid alert: Motion not related to ['Vehicle', 'Vehicle registration plate', 'Car']")
+        alertOutcomes.inc(deviceSerial, 'irrelevant')
+
+
+# motion alert job with its total duration
+def timedMotionAlert(deviceSerial, deviceName, occurredAt, group):
+    with alertSeconds.time(deviceSerial):
+        try:
+            processMotionAlert(deviceSerial, deviceName, occurredAt, group)
+        except Exception:
+            alertOutcomes.inc(deviceSerial, 'error')
+            raise
+
+
 @mainApp.route('/webhook', methods=['POST'])
 def webhook():
-    global runScript
-    if request.method == 'POST' and request.headers['Content-Type'] == 'application/json' and runScript == True:
+    if request.method == 'POST' and request.headers['Content-Type'] == 'application/json':
         payload = request.json
         if payload['sharedSecret'] == MV_SHARED_KEY and payload['alertTypeId'] == 'motion_alert':
 
-            # change the runScript to prevent the server from being flooded by alerts
-            if runScript == True:
-                runScript = False
-
             # define variable
             deviceSerial = payload['deviceSerial']
             deviceName = payload['deviceName']
             occurredAt = payload['occurredAt']
 
-            # wait several seconds for the car to be parked, then take a snapshot
-            time.sleep(waitTime)
-            snapTime = addSeconds(occurredAt, waitTime)
-
-            # then take max 5 snapshots loop: retrieving snapshot, car plate, image labels
-            for i in range(3):
-                print('---------HERE COMES SNAPSHOT LOOP #%d---------' % i)
-                # generate snapshot url
-                snapResponse = snapshotAndUri(
-                    deviceSerial, occurredAt, snapTime)
-
-                # for testing without meraki camera
-                # snapResponse = {'url': ''}
-                # snapResponse['url'] = 'https://assets.publishing.service.gov.uk/government/uploads/system/uploads/image_data/file/110487/s960_960-green-number-plate.jpg'
-
-                # filter the snapshot for vehicle and car plate
-                filterResult = visionFiltering(snapResponse['url'])
-
-                # if there are relevant labels detected, run plate detection
-                if filterResult == True:
-                    # detecting car plate from snapshot url
-                    detectedPlate = detectTextURI(snapResponse['url'])
-
-                    # if car plate is detected, check order information
-                    if detectedPlate != []:
-                        # loop through the text detection result
-                        for plate in detectedPlate:
-                            # search for a plate match in the order database
-                            print('1st order check for breaking the loop:')
-                            searchOrder = getOrder(plate)
-
-                        # if there is an order match, break from the loop
-                        if searchOrder != []:
-                            break
-                        # if there is no order match, wait and take the snapshot again
-                        else:
-                            time.sleep(intervalTime)
-                            snapTime = addSeconds(snapTime, intervalTime)
-                            continue
-
-                    # if there is no car plate detected, wait and take the snapshot again
-                    else:
-                        time.sleep(intervalTime)
-                        snapTime = addSeconds(snapTime, intervalTime)
-                        continue
-
-                # if no relevant labels detected, wait and take snapshot again
-                else:
-                    time.sleep(intervalTime)
-                    snapTime = addSeconds(snapTime, intervalTime)
-                    continue
-
-            # if there is relevant labels but car plate is not detected at all, send snapshot url to webex for manual check, using a dedicated space
-            if filterResult == True and detectedPlate == []:
-                postCard_noPlate(snapResponse, WEBEX_ROOM_ID)
-
-            # if there is relevant labels and a car plate is detected, store car event in database, then send webex notification
-            elif filterResult == True and detectedPlate != []:
-                for plate in detectedPlate:
-                    # store car event to database
-                    carToDB(plate, snapTime, deviceName)
-
-                    # retrieve the order again
-                    print('2nd order check for webex payload:')
-                    searchOrder = getOrder(plate)
-
-                    # post to webex. the message will be different based on whether a plate match an order or not
-                    postCard_plateDetected(
-                        snapResponse, searchOrder, plate, WEBEX_ROOM_ID)
-
-            # if no relevant labels detected
-            elif filterResult == False:
-                print(
-                    "Invalid alert: Motion not related to ['Vehicle', 'Vehicle registration plate', 'Car']")
-
-            # reset the runScript for the next car event
-            runScript = True
-            return Response(status=200)
+            # an alert of a camera whose previous alert is still waiting for its snapshot joins that job
+            group, isNew = alertCoalescer.admit(deviceSerial, deviceName, occurredAt)
+            if not isNew:
+                alertsCoalesced.inc(deviceSerial)
+                print('Motion alert of {} at {} joins the alert at {}'.format(
+                    deviceSerial, occurredAt, group.firstOccurredAt))
+                return Response(status=202)
+
+            # hand the alert over to the worker pool, alerts of the same camera are processed in order
+            try:
+                jobQueue.submit(deviceSerial, timedMotionAlert,
+                                deviceSerial, deviceName, occurredAt, group)
+            except JobQueueFull as e:
+                print(e)
+                alertCoalescer.discard(group)
+                abort(503, 'Too many motion alerts are waiting to be processed')
+
+            return Response(status=202)
 
         else:
             print('Invalid Meraki secret key, or not a motion alert')
             abort(400, 'Invalid Meraki secret key, or not a motion alert')
 
     else:
-        print('Unauthorized action, or webhook is filtered by runScript')
-        abort(400, 'Unauthorized action, or webhook is filtered by runScript boolean')
+        print('Unauthorized action')
+        abort(400, 'Unauthorized action')
+
+
+# counters of the processing pipeline
+@mainApp.route('/stats', methods=['GET'])
+def stats():
+    return {
+        'pendingJobs': jobQueue.depth(),
+        'pendingCardActions': cardActionQueue.depth(),
+        'alertCoalescer': alertCoalescer.stats(),
+        'snapshotTiming': snapshotTiming.stats(),
+        'visionPrep': visionPrep.stats(),
+        'snapshotDedupe': snapshotDedupe.stats(),
+        'carEventBuffer': carEventBuffer.stats()
+    }
+
+
+# Prometheus text format, see metrics
+@mainApp.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# the ordering app posts every created or updated order here to keep the order index in sync
+# with the SQLite backend, this is also where orders are stored: an order without id is created
+@mainApp.route('/order_event', methods=['POST'])
+def order_event():
+    # the server is reachable from the internet: only the ordering app may create or change orders
+    secret = request.headers.get('X-Shared-Secret', '')
+    if not ORDER_SHARED_KEY or not hmac.compare_digest(secret.encode(), ORDER_SHARED_KEY.encode()):
+        abort(403, 'A valid X-Shared-Secret header is expected')
+    order = request.json
+    if order is None or ('id' not in order and DB_BACKEND != 'sqlite'):
+        abort(400, 'An order with an id is expected')
+    # checked before the order is stored, the order index needs both fields
+    try:
+        orderTimestamp(order)
+        if not order['car_plate']:
+            raise ValueError('empty car_plate')
+    except (KeyError, TypeError, ValueError) as e:
+        abort(400, 'An order with a car_plate and a time is expected ({})'.format(e))
+    order.setdefault('serviced', False)
+
+    return ingestOrder(order), 201
 
 
 @mainApp.route("/card_action", methods=["POST"])
@@ -136,11 +509,40 @@ def card_action():
     # print(webhook_obj)
     # print(request.json)
 
-    # change serviced status in db
-    respond_to_button_press(webhook_obj)
+    # change serviced status in db, in the background so the webhook is acknowledged right away
+    try:
+        cardActionQueue.submit(webhook_obj.data.id, respond_to_button_press, webhook_obj)
+    except JobQueueFull as e:
+        print(e)
+        abort(503, 'Too many card actions are waiting to be processed')
     return Response(status=200)
 
 
+# background work of the server, started once by the serving process, not when the module is imported
+def startBackground():
+    startWorkers()
+
+    try:
+        loadOrderIndex()
+    except STORAGE_ERRORS as e:
+        print('Could not load the order index, orders are searched in DB = ', e)
+    threading.Thread(target=refreshOrderIndex, args=(ORDER_INDEX_REFRESH,),
+                     daemon=True).start()
+
+    # snapshot times learned from the past car events
+    try:
+        loadSnapshotTiming()
+    except STORAGE_ERRORS as e:
+        print('Could not load the car events, default snapshot timing is used = ', e)
+
+    # old car events archived every ARCHIVE_INTERVAL seconds, when ARCHIVE_AFTER_DAYS is set
+    if eventArchive is not None:
+        threading.Thread(target=archiveOldEvents, args=(int(os.getenv('ARCHIVE_INTERVAL', 86400)),),
+                         daemon=True).start()
+
+
 # run Flask server
+# without the reloader of the debug mode, which would run a second server process next to the serving one
 if __name__ == '__main__':
-    mainApp.run()
+    startBackground()
+    mainApp.run(use_reloader=False)
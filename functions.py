@@ -2,14 +2,27 @@
 from datetime import datetime, timedelta
 import requests
 import shutil
-import json
 import time
 import meraki
 import os
-import io
+import threading
+import atexit
+import sqlite3
 from dotenv import load_dotenv
-from google.cloud import vision
 from webexteamssdk import WebexTeamsAPI
+from snapshot_readiness import ReadinessTracker
+from snapshot_timing import SnapshotTiming
+from db_client import DBClient
+from storage import JsonServerStore, SqliteStore
+from event_archive import EventArchive, rollOverEvents
+from snapshot_store import SnapshotStore
+from write_behind import WriteBehindBuffer
+from order_index import OrderIndex
+from plate_vision import LABEL_LIST, filterLabels, detectLabelsURI
+from webex_outbox import WebexSender, PRIORITY_ARRIVED, PRIORITY_NO_MATCH, PRIORITY_NO_PLATE
+from card_renderer import CARD_TEMPLATE
+from job_queue import DelayedQueue
+from metrics import MetricsRegistry
 
 
 # search .env and load environment variable
@@ -20,16 +33,120 @@ DB_HOST = os.getenv('DB_HOST')
 WEBEX_TOKEN = os.getenv('WEBEX_TOKEN')
 GOOGLE_APPLICATION_CREDENTIALS = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
 
-# webex API instance
-webexAPI = WebexTeamsAPI(access_token=WEBEX_TOKEN)
+# API addresses, only changed to run against local stand-ins, see benchmarks/load_test.py
+MERAKI_BASE_URL = os.getenv('MERAKI_BASE_URL', 'https://api.meraki.com/api/v1')
+WEBEX_BASE_URL = os.getenv('WEBEX_BASE_URL', 'https://webexapis.com/v1/')
 
-# google Vision API client instance
-client = vision.ImageAnnotatorClient()
-imageUrl = vision.Image()
+# webex API instance, waits and retries when rate limited (card actions, message deletion, webhooks)
+webexAPI = WebexTeamsAPI(access_token=WEBEX_TOKEN, base_url=WEBEX_BASE_URL)
+
+# instance used by the webex sender only: rate limits are handled by the sender instead of blocking it
+webexSenderAPI = WebexTeamsAPI(access_token=WEBEX_TOKEN, base_url=WEBEX_BASE_URL, wait_on_rate_limit=False)
+
+# per stage latency and outcome counters, rendered by the /metrics route of the flask server
+metrics = MetricsRegistry()
+stageSeconds = metrics.histogram('plate_stage_seconds', 'Duration of each motion alert stage',
+                                 ('stage', 'camera'))
+alertSeconds = metrics.histogram('plate_alert_seconds', 'Duration of a whole motion alert', ('camera',))
+alertOutcomes = metrics.counter('plate_alerts_total', 'Processed motion alerts by outcome',
+                                ('camera', 'outcome'))
+snapshotRetries = metrics.counter('plate_snapshot_retries_total', 'Snapshots taken again after the first one',
+                                  ('camera',))
+visionErrors = metrics.counter('plate_vision_errors_total', 'Google Vision requests that failed', ('camera',))
+webexSendSeconds = metrics.histogram('webex_send_seconds', 'Duration of a Webex message post')
+webexSendErrors = metrics.counter('webex_send_errors_total', 'Webex message posts that failed')
+
+
+def sendWebexMessage(**message):
+    with webexSendSeconds.time():
+        try:
+            return webexSenderAPI.messages.create(**message)
+        except Exception:
+            webexSendErrors.inc()
+            raise
+
+
+# notifications are queued and posted by a dedicated sender thread, see postCard_plateDetected() and startWorkers()
+webexSender = WebexSender(sendWebexMessage,
+                          outboxPath=os.getenv('WEBEX_OUTBOX', 'webex_outbox.db'))
+
+# timeout in seconds when downloading a snapshot
+SNAPSHOT_TIMEOUT = 10
+
+# meraki dashboard API instance, see getDashboard()
+mvDashboard = None
+mvDashboardLock = threading.Lock()
+
+# pooled JSON-server client, the connections are kept alive between the DB calls
+dbClient = DBClient(DB_HOST or '',
+                    poolSize=int(os.getenv('DB_POOL_SIZE', 10)),
+                    timeout=float(os.getenv('DB_TIMEOUT', 5)),
+                    retries=int(os.getenv('DB_RETRIES', 3)))
+
+# card text sending the staff to the database, a link when it is JSON-server (DB_HOST is not needed with SQLite)
+CHECK_DB_TEXT = "[Check DB manually](" + DB_HOST + ")" if DB_HOST else "Check DB manually"
+
+# order and car event storage: 'json-server' (DB_HOST) or 'sqlite' (DB_PATH)
+DB_BACKEND = os.getenv('DB_BACKEND', 'json-server')
+if DB_BACKEND == 'sqlite':
+    storage = SqliteStore(os.getenv('DB_PATH', 'db_server.sqlite'))
+else:
+    storage = JsonServerStore(dbClient)
+STORAGE_ERRORS = (requests.RequestException, sqlite3.Error)
+
+# car events are written in batches of CAR_EVENT_BATCH, or after CAR_EVENT_DELAY seconds, the rest is flushed on exit
+# events the database did not take on exit are kept in CAR_EVENT_SPILL and written at the next start
+carEventBuffer = WriteBehindBuffer(storage.addCarEvents,
+                                   maxBatch=int(os.getenv('CAR_EVENT_BATCH', 50)),
+                                   maxDelay=float(os.getenv('CAR_EVENT_DELAY', 1)),
+                                   spillPath=os.getenv('CAR_EVENT_SPILL', 'car_event_spill.jsonl'),
+                                   maxDepth=int(os.getenv('CAR_EVENT_MAX_DEPTH', 10000)))
+
+# car events older than ARCHIVE_AFTER_DAYS are moved to daily segments in ARCHIVE_DIR, 0 keeps them in the database
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', 0))
+eventArchive = EventArchive(os.getenv('ARCHIVE_DIR', 'archive')) if ARCHIVE_AFTER_DAYS > 0 else None
+
+# snapshots of the notified alerts kept by content hash in SNAPSHOT_ARCHIVE_DIR, see archiveSnapshot()
+SNAPSHOT_ARCHIVE_DIR = os.getenv('SNAPSHOT_ARCHIVE_DIR', '')
+snapshotStore = SnapshotStore(SNAPSHOT_ARCHIVE_DIR) if SNAPSHOT_ARCHIVE_DIR else None
+
+# plate to open order index, see loadOrderIndex()
+orderIndex = OrderIndex(
+    ttlSeconds=float(os.getenv('ORDER_TTL_HOURS', 24)) * 3600)
+
+# max edit distance between an OCR plate and an order plate, after removing the OCR confusions (O/0, I/1, B/8...)
+# 0 by default: a real one character difference (AB12 CDE / AB13 CDE) is another car, not a misread
+PLATE_MAX_DISTANCE = int(os.getenv('PLATE_MAX_DISTANCE', 0))
+
+# card button presses: message deletion delay, and window where repeated presses on an order are collapsed
+CARD_DELETE_DELAY = 3
+CARD_ACTION_WINDOW = 60
+recentCardActions = {}
+cardActionsLock = threading.Lock()
+delayedTasks = DelayedQueue()
+
+# per camera time-to-ready of the generated snapshots, drives the availability polling
+snapshotReadiness = ReadinessTracker()
+
+# per camera snapshot times after the last motion, learned from the read delays stored with the car events
+# SNAPSHOT_SCHEDULE is used for the cameras without enough history
+snapshotTiming = SnapshotTiming(
+    defaultSchedule=[float(delay) for delay in os.getenv('SNAPSHOT_SCHEDULE', '12,16,20').split(',')],
+    missPenalty=float(os.getenv('SNAPSHOT_MISS_PENALTY', 30)),
+    explore=float(os.getenv('SNAPSHOT_EXPLORE', 0.1)))
 
 
 ####################################################################################
 # ------------------------------------GENERAL---------------------------------------
+# webex sender (replaying the outbox) and car event writer (replaying the spill file), started by the flask server
+# process only: importing this module, e.g. from reprocess_snapshots.py, sends no message and writes no car event
+def startWorkers():
+    webexSender.start()
+    atexit.register(webexSender.stop)
+    carEventBuffer.start()
+    atexit.register(carEventBuffer.close)
+
+
 # time string to object
 def timeStrToObj(timeString):
     timeObj = datetime.strptime(timeString[:19], "%Y-%m-%dT%H:%M:%S")
@@ -44,17 +161,6 @@ def addSeconds(timeString, second):
     return dateTimeISO
 
 
-# filter the labels from a pre-defined label list
-def filterLabels(labels, lst):
-    for label in labels:
-        for part in lst:
-            if label == part:
-                print('There is at least a relevant label in the snapshot = ', label)
-                return True
-    print('There is no relevant label in the snapshot')
-    return False
-
-
 # label detection and check
 def visionFiltering(url):
 
@@ -62,13 +168,18 @@ def visionFiltering(url):
     detectedLabel = detectLabelsURI(url)
 
     # filter the snapshot with labels
-    labelList = ['Vehicle', 'Vehicle registration plate', 'Car']
-    boolResult = filterLabels(detectedLabel, labelList)
+    boolResult = filterLabels(detectedLabel, LABEL_LIST)
     return boolResult
 
 
-# download image and save img to local
-def saveToLocal(url, filename):
+# download image and save img to local, content already downloaded is written without fetching the url again
+def saveToLocal(url, filename, content=None):
+
+    if content is not None:
+        with open(filename, 'wb') as f:
+            f.write(content)
+        print('Image sucessfully saved: ', filename)
+        return
 
     # Open the url image, set stream to True, this will return the stream content.
     r = requests.get(url, stream=True)
@@ -90,35 +201,103 @@ def saveToLocal(url, filename):
 ###################################################################################
 # ------------------------------------MERAKI---------------------------------------
 # generate snapshot and check if the url is accessible
-def snapshotAndUri(deviceSerial, occurredAt, snapTime):
+# cancelled: optional threading.Event, set when the snapshot is not needed anymore, see the speculative snapshots
+def snapshotAndUri(deviceSerial, occurredAt, snapTime, cancelled=None):
 
     # generate snapshot and perform analysis
-    mvDashboard = meraki.DashboardAPI(MV_API_KEY)
-    snapResponse = mvDashboard.camera.generateDeviceCameraSnapshot(
-        deviceSerial, timestamp=snapTime)
+    with stageSeconds.time('snapshot', deviceSerial):
+        snapResponse = getDashboard().camera.generateDeviceCameraSnapshot(
+            deviceSerial, timestamp=snapTime)
     print("Snapshot url is generated = ", snapResponse,
           '\nMotion occured at = ', occurredAt,
           '\nStable snapshot taken at = ', snapTime)
 
-    # check if the image url is accessible
-    for i in range(5):
+    # download the image once it is accessible, the bytes are reused by the rest of the pipeline
+    # a streamed GET only reads the headers while the snapshot is not ready, so it is as cheap as a HEAD probe
+    snapResponse['content'] = None
+    generatedAt = time.monotonic()
+    pollStart = time.perf_counter()
+    lastProbe = 0
+    for delay in snapshotReadiness.delays(deviceSerial):
         # wait for a short time until the snapshot is available
-        time.sleep(3)
+        if cancelled is not None and cancelled.wait(delay):
+            break
+        elif cancelled is None:
+            time.sleep(delay)
 
         # check if snapshot is accessible
-        image_response = requests.get(snapResponse['url'])
+        probeAt = time.monotonic() - generatedAt
+        content = fetchSnapshot(snapResponse['url'])
 
-        # If HTTP code 200 (OK) is returned, quit the loop and continue
-        if image_response.status_code == 200:
+        # If the image is downloaded, quit the loop and continue
+        if content is not None:
+            snapResponse['content'] = content
+            snapshotReadiness.record(deviceSerial, (lastProbe + probeAt) / 2)
             break
         else:
             print(
-                f"Could not access snapshot for camera {deviceSerial} right now. Wait for 3 sec.")
+                f"Could not access snapshot for camera {deviceSerial} right now. Probing again with backoff.")
+            lastProbe = probeAt
             continue
 
+    stageSeconds.observe(time.perf_counter() - pollStart, 'snapshot_ready', deviceSerial)
     return snapResponse
 
 
+# meraki dashboard client shared by all the jobs, created on first use
+def getDashboard():
+    global mvDashboard
+    with mvDashboardLock:
+        if mvDashboard is None:
+            mvDashboard = meraki.DashboardAPI(
+                MV_API_KEY, base_url=MERAKI_BASE_URL, output_log=False, print_console=False)
+    return mvDashboard
+
+
+# stream the snapshot into memory, None if it is not available (yet)
+def fetchSnapshot(url):
+    with requests.get(url, stream=True, timeout=SNAPSHOT_TIMEOUT) as r:
+        if r.status_code != 200:
+            return None
+
+        buffer = bytearray()
+        for chunk in r.iter_content(chunk_size=64 * 1024):
+            buffer.extend(chunk)
+
+    return bytes(buffer)
+
+
+# keep the snapshot of an alert for later audits, indexed under the camera, time and each (plate, order id)
+# the url is streamed to disk when the snapshot was not downloaded, returns the snapshot digest or None
+def archiveSnapshot(snapResponse, camera, time, tags=((None, None),)):
+    if snapshotStore is None:
+        return None
+
+    try:
+        if snapResponse.get('content') is not None:
+            digest = snapshotStore.put(snapResponse['content'])
+        else:
+            with requests.get(snapResponse['url'], stream=True, timeout=SNAPSHOT_TIMEOUT) as r:
+                if r.status_code != 200:
+                    print('Could not download the snapshot to archive = ', r.status_code)
+                    return None
+                digest = snapshotStore.putStream(r.iter_content(chunk_size=64 * 1024))
+        if digest is not None:
+            for plate, orderId in tags:
+                snapshotStore.tag(digest, camera, time, plate, orderId)
+    except (requests.RequestException, OSError, sqlite3.Error) as e:
+        print('Could not archive the snapshot = ', e)
+        return None
+    return digest
+
+
+# image given to google vision: the downloaded bytes, or the url if the download failed
+def snapshotSource(snapResponse):
+    if snapResponse.get('content') is not None:
+        return snapResponse['content']
+    return snapResponse['url']
+
+
 ##################################################################################
 # ------------------------------------WEBEX---------------------------------------
 # post to Webex if any car plate is detected
@@ -146,8 +325,8 @@ def postToWebex_plateDetected(snapResponse, searchOrder, plate, room_id):
         except Exception as e:
             teams_message = 'There was a Webex error: Notification when car plate does not match the order'
 
-    webexAPI.messages.create(
-        roomId=room_id, markdown=teams_message)
+    webexSender.enqueue(PRIORITY_ARRIVED if searchOrder != [] else PRIORITY_NO_MATCH,
+                        roomId=room_id, markdown=teams_message)
 
 
 def postToWebex_noPlate(snapResponse, room_id):
@@ -157,157 +336,8 @@ def postToWebex_noPlate(snapResponse, room_id):
     except Exception as e:
         teams_message = 'There was a Webex error: Notification when no car plate detected'
 
-    webexAPI.messages.create(
-        roomId=room_id, markdown=teams_message)
-
-
-# webex card payload
-CARD_CONTENT = {
-    "type": "AdaptiveCard",
-    "body": [
-        {
-            "type": "ColumnSet",
-            "columns": [
-                {
-                    "type": "Column",
-                    "items": [
-                        {
-                            "type": "Image",
-                            "url": "Icon image url",  # parameter
-                            "size": "Medium",
-                            "height": "50px",
-                            "backgroundColor": "White"
-                        }
-                    ],
-                    "width": "auto"
-                },
-                {
-                    "type": "Column",
-                    "items": [
-                        {
-                            "type": "TextBlock",
-                            "text": "Meraki Car Plate Detection",
-                            "color": "Good",
-                            "size": "Small",
-                            "weight": "Lighter"
-                        },
-                        {
-                            "type": "TextBlock",
-                            "text": "CUSTOMER HAS ARRIVED",  # parameter
-                            "wrap": True,
-                            "color": "Accent",  # parameter
-                            "size": "Medium",
-                            "spacing": "Small",
-                            "weight": "Bolder"
-                        }
-                    ],
-                    "width": "stretch"
-                }
-            ]
-        },
-        {
-            "type": "ColumnSet",
-            "columns": [
-                {
-                    "type": "Column",
-                    "width": 35,
-                    "items": [
-                        {
-                            "type": "TextBlock",
-                            "text": "Car plate:",
-                            "color": "Light"
-                        },
-                        {
-                            "type": "TextBlock",
-                            "text": "Name:",
-                            "weight": "Lighter",
-                            "color": "Light",
-                            "spacing": "Small"
-                        },
-                        {
-                            "type": "TextBlock",
-                            "text": "Menu / Qty:",
-                            "weight": "Lighter",
-                            "color": "Light",
-                            "spacing": "Small"
-                        },
-                        {
-                            "type": "TextBlock",
-                            "text": "Date order / ID:",
-                            "weight": "Lighter",
-                            "color": "Light",
-                            "spacing": "Small"
-                        }
-                    ]
-                },
-                {
-                    "type": "Column",
-                    "width": 65,
-                    "items": [
-                        {
-                            "type": "TextBlock",
-                            "text": "[BMW I8]()",  # parameter
-                            "color": "Light"
-                        },
-                        {
-                            "type": "TextBlock",
-                            "text": "Bob",  # parameter
-                            "color": "Light",
-                            "weight": "Lighter",
-                            "spacing": "Small"
-                        },
-                        {
-                            "type": "TextBlock",
-                            "text": "Burger / 2",  # parameter
-                            "weight": "Lighter",
-                            "color": "Light",
-                            "spacing": "Small"
-                        },
-                        {
-                            "type": "TextBlock",
-                            "text": "18 May 2021",  # parameter
-                            "weight": "Lighter",
-                            "color": "Light",
-                            "spacing": "Small"
-                        }
-                    ]
-                }
-            ],
-            "spacing": "Padding",
-            "horizontalAlignment": "Center"
-        },
-        {
-            "type": "Image",
-            "url": "image_url"  # parameter
-        },
-        {
-            "type": "ActionSet",
-            "actions": [
-                {
-                    "type": "Action.Submit",
-                    "title": "Process Order",
-                    "data": {
-                        "orderId": "order_id",  # parameter
-                        "type": "orderProcessed"
-                    },
-                    "style": "positive"
-                },
-                {
-                    "type": "Action.Submit",
-                    "title": "Discard Order",
-                    "data": {
-                        "orderId": "order_id",  # parameter
-                        "type": "orderDiscarded"
-                    },
-                    "style": "positive"
-                }
-            ],
-            "spacing": "None"
-        }
-    ],
-    "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
-    "version": "1.2"
-}
+    webexSender.enqueue(PRIORITY_NO_PLATE,
+                        roomId=room_id, markdown=teams_message)
 
 
 # post webex card as notification
@@ -317,85 +347,59 @@ def postCard_plateDetected(snapResponse, searchOrder, plate, room_id):
         iconUrl = "https://www.shareicon.net/data/128x128/2016/10/11/842378_multimedia_512x512.png"
         timeObj = timeStrToObj(searchOrder['time'])
 
-        # payload parameter
-        CARD_CONTENT["body"][0]["columns"][0]["items"][0]['url'] = iconUrl
-        CARD_CONTENT["body"][0]["columns"][1]["items"][1]['text'] = "CUSTOMER HAS ARRIVED"
-        CARD_CONTENT["body"][0]["columns"][1]["items"][1]['color'] = "Accent"
-        CARD_CONTENT["body"][1]["columns"][1]["items"][0]['text'] = '[' + \
-            plate + '](' + snapResponse['url'] + ')'
-        CARD_CONTENT["body"][1]["columns"][1]["items"][1]['text'] = searchOrder['customer']
-        CARD_CONTENT["body"][1]["columns"][1]["items"][2]['text'] = searchOrder['menu'] + \
-            ' / ' + str(searchOrder['qty'])
-        CARD_CONTENT["body"][1]["columns"][1]["items"][3]['text'] = timeObj.strftime(
-            "%d-%b-%Y (%H:%M)") + ' / #' + str(searchOrder['id'])
-        CARD_CONTENT["body"][2]["url"] = snapResponse['url']
-
-        # input order id
-        CARD_CONTENT["body"][3]["actions"][0]["data"]["orderId"] = str(
-            searchOrder['id'])
-        CARD_CONTENT["body"][3]["actions"][1]["data"]["orderId"] = str(
-            searchOrder['id'])
-
-        webexAPI.messages.create(
+        # payload parameter, the card is rendered for this notification only
+        message = CARD_TEMPLATE.render(
             roomId=room_id,
-            text="If you see this your client cannot render cards",
-            attachments=[{
-                "contentType": "application/vnd.microsoft.card.adaptive",
-                "content": CARD_CONTENT
-            }]
-        )
+            iconUrl=iconUrl,
+            title="CUSTOMER HAS ARRIVED",
+            titleColor="Accent",
+            plate='[' + plate + '](' + snapResponse['url'] + ')',
+            customer=searchOrder['customer'],
+            menu=searchOrder['menu'] + ' / ' + str(searchOrder['qty']),
+            orderTime=timeObj.strftime(
+                "%d-%b-%Y (%H:%M)") + ' / #' + str(searchOrder['id']),
+            imageUrl=snapResponse['url'],
+            # input order id
+            orderId=searchOrder['id'])
+
+        webexSender.enqueueJson(PRIORITY_ARRIVED, message)
 
     else:
         iconUrl = "https://findicons.com/files/icons/1671/simplicio/128/notification_warning.png"
 
         # payload parameter
-        CARD_CONTENT["body"][0]["columns"][0]["items"][0]['url'] = iconUrl
-        CARD_CONTENT["body"][0]["columns"][1]["items"][1]['text'] = "CAR PLATE DETECTED BUT NO ORDER MATCH"
-        CARD_CONTENT["body"][0]["columns"][1]["items"][1]['color'] = "Attention"
-        CARD_CONTENT["body"][1]["columns"][1]["items"][0][
-            'text'] = '[' + plate + '](' + snapResponse['url'] + ')'
-        CARD_CONTENT["body"][1]["columns"][1]["items"][1][
-            'text'] = "[Check DB manually](" + DB_HOST + ")"
-        CARD_CONTENT["body"][1]["columns"][1]["items"][2][
-            'text'] = "[Check DB manually](" + DB_HOST + ")"
-        CARD_CONTENT["body"][1]["columns"][1]["items"][3][
-            'text'] = "[Check DB manually](" + DB_HOST + ")"
-        CARD_CONTENT["body"][2]["url"] = snapResponse['url']
-
-        webexAPI.messages.create(
+        message = CARD_TEMPLATE.render(
             roomId=room_id,
-            text="If you see this your client cannot render cards",
-            attachments=[{
-                "contentType": "application/vnd.microsoft.card.adaptive",
-                "content": CARD_CONTENT
-            }]
-        )
+            iconUrl=iconUrl,
+            title="CAR PLATE DETECTED BUT NO ORDER MATCH",
+            titleColor="Attention",
+            plate='[' + plate + '](' + snapResponse['url'] + ')',
+            customer=CHECK_DB_TEXT,
+            menu=CHECK_DB_TEXT,
+            orderTime=CHECK_DB_TEXT,
+            imageUrl=snapResponse['url'],
+            orderId="order_id")
+
+        webexSender.enqueueJson(PRIORITY_NO_MATCH, message)
 
 
 # post webex card as notification, if there is no plate detected
 def postCard_noPlate(snapResponse, room_id):
     iconUrl = "https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcSTPj1GNmlY8kDIjgTtZMmE-M4luNDMMRZbOQ&usqp=CAU"
 
-    CARD_CONTENT["body"][0]["columns"][0]["items"][0]['url'] = iconUrl
-    CARD_CONTENT["body"][0]["columns"][1]["items"][1]['text'] = "VEHICLE MOTION DETECTED BUT FAILED TO RECOGNIZE CAR PLATE"
-    CARD_CONTENT["body"][0]["columns"][1]["items"][1]['color'] = "Warning"
-    CARD_CONTENT["body"][1]["columns"][1]["items"][0][
-        'text'] = "[Check DB manually](" + DB_HOST + ")"
-    CARD_CONTENT["body"][1]["columns"][1]["items"][1][
-        'text'] = "[Check DB manually](" + DB_HOST + ")"
-    CARD_CONTENT["body"][1]["columns"][1]["items"][2][
-        'text'] = "[Check DB manually](" + DB_HOST + ")"
-    CARD_CONTENT["body"][1]["columns"][1]["items"][3]['text'] = "N/A"
-    CARD_CONTENT["body"][2]["url"] = snapResponse['url']
-
-    webexAPI.messages.create(
+    message = CARD_TEMPLATE.render(
         roomId=room_id,
-        text="If you see this your client cannot render cards",
-        attachments=[{
-            "contentType": "application/vnd.microsoft.card.adaptive",
-            "content": CARD_CONTENT
-        }]
-    )
+        iconUrl=iconUrl,
+        title="VEHICLE MOTION DETECTED BUT FAILED TO RECOGNIZE CAR PLATE",
+        titleColor="Warning",
+        plate=CHECK_DB_TEXT,
+        customer=CHECK_DB_TEXT,
+        menu=CHECK_DB_TEXT,
+        orderTime="N/A",
+        imageUrl=snapResponse['url'],
+        orderId="order_id")
+
+    webexSender.enqueueJson(PRIORITY_NO_PLATE, message)
 
 
 # create webex webhook to subscribe to card action
@@ -422,6 +426,7 @@ def delete_webhooks():
 
 
 # when card action is pressed > change serviced status in db
+# runs in a background worker, the card message is deleted later by the delayed queue
 def respond_to_button_press(webhook_obj):
     """
     Respond to a button press on the card we posted
@@ -429,197 +434,181 @@ def respond_to_button_press(webhook_obj):
     attachment_action = webexAPI.attachment_actions.get(webhook_obj.data.id)
     orderId = attachment_action.inputs['orderId']
 
-    # change the serviced value in the database
     if attachment_action.inputs['type'] == "orderProcessed":
         serviced = True
-        updateServicedStatus(orderId, serviced)
-        print("Serviced updated: ", serviced)
-        time.sleep(3)
-        webexAPI.messages.delete(attachment_action.messageId)
-        print("Message deleted: Order ID ", orderId)
-
     elif attachment_action.inputs['type'] == "orderDiscarded":
         serviced = False
-        updateServicedStatus(orderId, serviced)
-        print("Serviced updated: ", serviced)
-        time.sleep(3)
-        webexAPI.messages.delete(attachment_action.messageId)
-        print("Message deleted: Order ID ", orderId)
-
-###########################################################################################
-# ------------------------------------GOOGLE VISION API------------------------------------
-# detect text from image url
-
-
-def detectTextURI(url):
-    imageUrl.source.image_uri = url
-
-    response = client.text_detection(image=imageUrl)
-    texts = response.text_annotations
-
-    detectedPlate = []
-
-    for text in texts:
-        if '\n' in text.description:
-            detectedPlate.append(text.description.replace('\n', ''))
-
-    if response.error.message:
-        print("Car plate detection: Error")
-
-    if detectedPlate != []:
-        print("Car plate detected = ", detectedPlate)
-
-    return detectedPlate
-
-
-# detect label from image url
-def detectLabelsURI(url):
-    imageUrl.source.image_uri = url
-
-    response = client.label_detection(image=imageUrl)
-    labels = response.label_annotations
-
-    detectedLabel = []
-
-    for label in labels:
-        detectedLabel.append(label.description)
-
-    if response.error.message:
-        print("Label detection: Error")
-
-    if detectedLabel != []:
-        print("Snapshot labels detected = ", detectedLabel)
-
-    return detectedLabel
-
-
-# detect image from local path
-def detectTextLocal(path):
-
-    with io.open(path, 'rb') as image_file:
-        content = image_file.read()
-
-    imageLocal = vision.Image(content=content)
-
-    response = client.text_detection(image=imageLocal)
-    texts = response.text_annotations
-
-    detectedPlate = []
-
-    for text in texts:
-        if '\n' in text.description:
-            detectedPlate.append(text.description.replace('\n', ''))
-
-    if response.error.message:
-        raise Exception(
-            '{}\nFor more info on error messages, check: '
-            'https://cloud.google.com/apis/design/errors'.format(
-                response.error.message))
-
-    if detectedPlate != []:
-        print("Car plate detected = ", detectedPlate)
-
-    return detectedPlate
-
-
-# detect label from local path
-def detectLabelslocal(path):
+    else:
+        return
 
-    with io.open(path, 'rb') as image_file:
-        content = image_file.read()
+    # change the serviced value in the database, once for repeated presses on the same order
+    # if the database cannot be reached, the press is forgotten and the card kept so that it can be pressed again
+    if claimCardAction(orderId, serviced):
+        try:
+            updateServicedStatus(orderId, serviced)
+        except Exception:
+            releaseCardAction(orderId, serviced)
+            raise
+        print("Serviced updated: ", serviced)
+    else:
+        print("Serviced already updated: Order ID ", orderId)
 
-    imageLocal = vision.Image(content=content)
+    delayedTasks.schedule(CARD_DELETE_DELAY, attachment_action.messageId,
+                          deleteCardMessage, attachment_action.messageId, orderId)
 
-    response = client.label_detection(image=imageLocal)
-    labels = response.label_annotations
 
-    detectedLabel = []
+# False if the same serviced value was already applied to the order within CARD_ACTION_WINDOW seconds
+def claimCardAction(orderId, serviced):
+    now = time.time()
+    with cardActionsLock:
+        for key in [key for key, (value, at) in recentCardActions.items()
+                    if now - at > CARD_ACTION_WINDOW]:
+            del recentCardActions[key]
 
-    for label in labels:
-        detectedLabel.append(label.description)
+        previous = recentCardActions.get(orderId)
+        if previous is not None and previous[0] == serviced:
+            return False
+        recentCardActions[orderId] = (serviced, now)
+        return True
 
-    if response.error.message:
-        raise Exception(
-            '{}\nFor more info on error messages, check: '
-            'https://cloud.google.com/apis/design/errors'.format(
-                response.error.message))
 
-    if detectedLabel != []:
-        print("Snapshot labels detected = ", detectedLabel)
+# the update claimed by claimCardAction failed
+def releaseCardAction(orderId, serviced):
+    with cardActionsLock:
+        previous = recentCardActions.get(orderId)
+        if previous is not None and previous[0] == serviced:
+            del recentCardActions[orderId]
 
-    return detectedLabel
 
+def deleteCardMessage(messageId, orderId):
+    webexAPI.messages.delete(messageId)
+    print("Message deleted: Order ID ", orderId)
 
 ########################################################################################
-# ------------------------------------JSON SERVER---------------------------------------
-# store car event to database
-def carToDB(plate, time, location):
-    dbCarUrl = DB_HOST+'/car_event'
-
-    payload = json.dumps({
+# ------------------------------------DATABASE------------------------------------------
+# JSON-server or SQLite, see storage
+# store car event to database, written in the background with other events by carEventBuffer
+# the event of an alert with outcome set holds the delay (seconds after the last motion when the plate was first read,
+# None for a vehicle without readable plate) that feeds snapshotTiming, one per alert whatever the number of plates
+def carToDB(plate, time, location, camera=None, delay=None, outcome=False):
+    carEvent = {
         "plate": plate,
         "time": time,
         "location": location
-    })
-
-    headers = {
-        'Content-Type': 'application/json'
     }
-
-    response = requests.request(
-        "POST", dbCarUrl, headers=headers, data=payload)
-
-    if response.status_code == 201:
-        print('New car entry has been stored in DB = ', response.json())
+    if camera is not None:
+        carEvent['camera'] = camera
+    if outcome:
+        carEvent['delay'] = delay
+    if carEventBuffer.add(carEvent):
+        print('New car entry has been queued for DB = ', carEvent)
     else:
-        print('Could not input new car entry in DB')
+        print('Could not queue the car entry, too many are waiting for DB = ', carEvent)
 
-    return response.json()
+    return carEvent
 
 
 # get existing order information
 def getOrder(plate):
-    dbOrderUrl = DB_HOST+'/order'
+    return getOrders([plate])[plate]
+
+
+# orders of several candidate plates in one index probe or DB request, [] for the plates without order
+def getOrders(plates):
+    plates = list(dict.fromkeys(plates))
+    found = {}
+
+    # once loaded, the order index answers without a DB round trip, tolerating OCR mistakes
+    # the plates it misses (e.g. orders older than ORDER_TTL_HOURS) are still searched in DB
+    missing = plates
+    if orderIndex.loaded:
+        missing = []
+        for plate, match in orderIndex.matchMany(plates, PLATE_MAX_DISTANCE).items():
+            if match is not None:
+                print('The most recent order that match ', plate, ' plate (score ',
+                      round(match['score'], 2), ') = ', match['order'])
+                found[plate] = match['order']
+            else:
+                missing.append(plate)
+
+    # search car plates by most recent entry, a serviced order is no arrival to notify (the index drops them too)
+    # the plates matched by the index are still notified when the DB is down
+    latestOrders = {}
+    if missing:
+        try:
+            latestOrders = storage.latestOrders(missing) or {}
+        except STORAGE_ERRORS as e:
+            print('Could not search the orders in DB = ', e)
+    for plate in missing:
+        searchOrder = latestOrders.get(plate)
+        if searchOrder is not None and not searchOrder.get('serviced'):
+            print('The most recent order that match ',
+                  plate, ' plate = ', searchOrder)
+            found[plate] = searchOrder
+        else:
+            print('There is no order match for ', plate, ' plate')
+            found[plate] = []
+    return found
 
-    queryParam = '?car_plate=' + plate + \
-        '&_sort=id&_order=desc&_limit=1'  # search car plate by most recent entry
 
-    url = dbOrderUrl + queryParam
+def updateServicedStatus(orderId, serviced):
+    order = storage.setServiced(orderId, serviced)
 
-    payload = {}
+    if order is not None:
+        print('Serviced status has been changed = ', order)
+        orderIndex.upsert(order)
+    else:
+        print('Could not change serviced status')
 
-    headers = {
-        'Content-Type': 'application/json'
-    }
+    return order
 
-    response = requests.request("GET", url, headers=headers, data=payload)
 
-    if response.status_code == 200:
-        print('The most recent order that match ',
-              plate, ' plate = ', response.json())
-    else:
-        print('There is no order match for ', plate, ' plate')
+# new or changed order from the ordering app: stored (SQLite backend), then indexed
+def ingestOrder(order):
+    order = storage.ingestOrder(order)
+    orderIndex.upsert(order)
+    return order
 
-    return response.json()[0] if response.json() != [] else response.json()
 
+# load the unserviced orders of the last ORDER_TTL_HOURS into the order index
+def loadOrderIndex():
+    since = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - orderIndex.ttlSeconds))
+    orders = storage.openOrders(since)
 
-def updateServicedStatus(orderId, serviced):
-    dbOrderUrl = DB_HOST+'/order/'+orderId
+    if orders is not None:
+        orderIndex.load(orders)
+        print('Order index loaded = ', len(orderIndex), ' open orders')
+    else:
+        print('Could not load the order index, orders are searched in DB')
 
-    payload = json.dumps({
-        "serviced": serviced
-    })
 
-    headers = {
-        'Content-Type': 'application/json'
-    }
+# learn the snapshot times of each camera from the recent car events
+def loadSnapshotTiming(limit=1000):
+    events = storage.recentCarEvents(limit)
 
-    response = requests.request(
-        "PATCH", dbOrderUrl, headers=headers, data=payload)
-
-    if response.status_code == 200:
-        print('Serviced status has been changed = ', response.json())
+    if events is not None:
+        snapshotTiming.learn(events)
+        print('Snapshot timing learned from ', len(events), ' car events')
     else:
-        print('Could not change serviced status')
+        print('Could not load the car events, default snapshot timing is used')
 
-    return response.json()
+
+# reload the order index and expire old orders periodically, catching orders not sent to the ingest endpoint
+def refreshOrderIndex(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            loadOrderIndex()
+        except STORAGE_ERRORS as e:
+            print('Could not refresh the order index = ', e)
+            orderIndex.expire()
+
+
+# move the old car events to the archive periodically, see event_archive
+def archiveOldEvents(interval):
+    while True:
+        try:
+            rollOverEvents(storage, eventArchive, ARCHIVE_AFTER_DAYS)
+        except STORAGE_ERRORS as e:
+            print('Could not archive the old car events = ', e)
+        time.sleep(interval)
@@ -0,0 +1,108 @@
+# background job queue for the flask server: webhooks are enqueued and processed by a worker pool
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
+import heapq
+import time
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+# worker pool where jobs sharing the same key (e.g. deviceSerial) run one after another,
+# while jobs of different keys run concurrently
+class JobQueue:
+
+    def __init__(self, workerCount=4, maxPending=100):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workerCount, thread_name_prefix='job')
+        self.maxPending = maxPending
+        self.lanes = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    # enqueue a job, raise JobQueueFull if too many jobs are waiting
+    def submit(self, key, func, *args, **kwargs):
+        with self.lock:
+            if self.pending >= self.maxPending:
+                raise JobQueueFull(
+                    'Job queue is full ({} pending jobs)'.format(self.pending))
+            self.pending += 1
+
+            # a lane only exists while a worker is draining it
+            if key in self.lanes:
+                self.lanes[key].append((func, args, kwargs))
+                return
+            self.lanes[key] = deque([(func, args, kwargs)])
+
+        self.executor.submit(self._drainLane, key)
+
+    # run every job of a lane in order, then release the lane
+    def _drainLane(self, key):
+        while True:
+            with self.lock:
+                lane = self.lanes[key]
+                if not lane:
+                    del self.lanes[key]
+                    return
+                func, args, kwargs = lane.popleft()
+
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                print('Background job for {} failed: {!r}'.format(key, e))
+            finally:
+                with self.lock:
+                    self.pending -= 1
+
+    # number of jobs queued or running
+    def depth(self):
+        with self.lock:
+            return self.pending
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+# tasks run by a single timer thread once their delay is over
+# a task scheduled again with the key of a pending task is collapsed into the pending one
+class DelayedQueue:
+
+    def __init__(self):
+        self.tasks = []
+        self.keys = set()
+        self.sequence = 0
+        self.condition = threading.Condition()
+        threading.Thread(target=self._run, name='delayed',
+                         daemon=True).start()
+
+    # False if a task with the same key is already waiting
+    def schedule(self, delay, key, func, *args):
+        with self.condition:
+            if key in self.keys:
+                return False
+            self.keys.add(key)
+            heapq.heappush(self.tasks, (time.monotonic() + delay,
+                                        self.sequence, key, func, args))
+            self.sequence += 1
+            self.condition.notify()
+        return True
+
+    def depth(self):
+        with self.condition:
+            return len(self.tasks)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.tasks or self.tasks[0][0] > time.monotonic():
+                    timeout = self.tasks[0][0] - time.monotonic() if self.tasks else None
+                    self.condition.wait(timeout)
+                due, sequence, key, func, args = heapq.heappop(self.tasks)
+                self.keys.discard(key)
+
+            try:
+                func(*args)
+            except Exception as e:
+                print('Delayed task for {} failed: {!r}'.format(key, e))
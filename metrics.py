@@ -0,0 +1,133 @@
+# in-process metrics rendered in the Prometheus text format, see the /metrics route of the flask server
+# each observation is a bisect and a few additions under a lock, cheap enough to stay on in production
+from contextlib import contextmanager
+from bisect import bisect_left
+import threading
+import time
+
+# seconds, from a dashboard API call to a whole motion alert
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120)
+
+
+def formatLabels(names, values, extra=''):
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def formatValue(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name, help, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = labelNames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} counter'.format(self.name)]
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            lines.append('{}{} {}'.format(self.name, formatLabels(
+                self.labelNames, labels), formatValue(value)))
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help, labelNames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelNames = labelNames
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # one count per bucket plus +Inf, then sum and count
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    # time the block, also when it raises
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self.series.items())
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucketCount
+                lines.append('{}_bucket{} {}'.format(self.name, formatLabels(
+                    self.labelNames, labels, 'le="{}"'.format(bound)), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, formatLabels(
+                self.labelNames, labels), repr(total)))
+            lines.append('{}_count{} {}'.format(self.name, formatLabels(
+                self.labelNames, labels), count))
+        return lines
+
+
+# value read when the metrics are scraped, e.g. a queue depth
+class Gauge:
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        return ['# HELP {} {}'.format(self.name, self.help),
+                '# TYPE {} gauge'.format(self.name),
+                '{} {}'.format(self.name, formatValue(self.read()))]
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelNames=()):
+        return self.add(Counter(name, help, labelNames))
+
+    def histogram(self, name, help, labelNames=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labelNames, buckets))
+
+    def gauge(self, name, help, read):
+        return self.add(Gauge(name, help, read))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,16 @@
+# import the JSON-server database (db_server.json) into the SQLite database used with DB_BACKEND=sqlite
+# usage: python migrate_db.py [db_server.json] [db_server.sqlite]
+
+import sys
+import json
+from storage import SqliteStore
+
+source = sys.argv[1] if len(sys.argv) > 1 else 'db_server.json'
+target = sys.argv[2] if len(sys.argv) > 2 else 'db_server.sqlite'
+
+with open(source) as f:
+    data = json.load(f)
+
+orderCount, eventCount = SqliteStore(target).importJson(data)
+print('Imported {} orders and {} car events from {} into {}'.format(
+    orderCount, eventCount, source, target))
@@ -0,0 +1,102 @@
+# local pre-filter run before google vision: rejects snapshots where nothing large enough changed in the pickup bay
+from PIL import Image
+import numpy as np
+import threading
+import time
+import io
+
+# resolution the snapshots are compared at
+FILTER_SIZE = (160, 120)
+
+
+# decode a snapshot to a small grayscale array
+def toGrayArray(content, size=FILTER_SIZE):
+    image = Image.open(io.BytesIO(content))
+    # let the jpeg decoder skip the detail we do not need
+    image.draft('L', (size[0] * 2, size[1] * 2))
+    image = image.convert('L').resize(size, Image.BILINEAR)
+    return np.asarray(image, dtype=np.float32)
+
+
+# 2x2 pooling of a boolean mask, a cell is set if most of its pixels are: removes isolated noisy pixels
+def poolMask(mask):
+    height, width = mask.shape[0] // 2 * 2, mask.shape[1] // 2 * 2
+    cells = mask[:height, :width].reshape(height // 2, 2, width // 2, 2)
+    return cells.sum(axis=(1, 3)) >= 3
+
+
+# size in pixels of the largest 4-connected blob of a boolean mask, the search stops once a blob reaches stopAt
+def largestBlob(mask, stopAt=None):
+    height, width = mask.shape
+    seen = np.zeros_like(mask)
+    largest = 0
+    for y, x in zip(*np.nonzero(mask)):
+        if seen[y, x]:
+            continue
+        seen[y, x] = True
+        stack = [(y, x)]
+        size = 0
+        while stack:
+            cy, cx = stack.pop()
+            size += 1
+            for ny, nx in ((cy - 1, cx), (cy + 1, cx), (cy, cx - 1), (cy, cx + 1)):
+                if 0 <= ny < height and 0 <= nx < width and mask[ny, nx] and not seen[ny, nx]:
+                    seen[ny, nx] = True
+                    stack.append((ny, nx))
+        largest = max(largest, size)
+        if stopAt is not None and largest >= stopAt:
+            break
+    return largest
+
+
+# per camera background model, compared with each new snapshot inside the bay region
+# regions: {deviceSerial: [left, top, right, bottom]} as fractions of the frame, the whole frame by default
+class MotionPrefilter:
+
+    def __init__(self, regions=None, alpha=0.2, pixelThreshold=30, minAreaRatio=0.03, minBlobRatio=0.02):
+        self.regions = regions or {}
+        self.alpha = alpha
+        self.pixelThreshold = pixelThreshold
+        self.minAreaRatio = minAreaRatio
+        self.minBlobRatio = minBlobRatio
+        self.backgrounds = {}
+        self.lock = threading.Lock()
+
+    # bay region of a camera in pixels of the filter resolution
+    def regionSlice(self, deviceSerial):
+        left, top, right, bottom = self.regions.get(deviceSerial, [0, 0, 1, 1])
+        width, height = FILTER_SIZE
+        return (slice(int(top * height), int(bottom * height)),
+                slice(int(left * width), int(right * width)))
+
+    # True if the snapshot may contain a vehicle and should go to google vision
+    def check(self, deviceSerial, content):
+        start = time.perf_counter()
+        frame = toGrayArray(content)
+
+        with self.lock:
+            background = self.backgrounds.get(deviceSerial)
+            if background is None:
+                self.backgrounds[deviceSerial] = frame
+            else:
+                self.backgrounds[deviceSerial] = (
+                    1 - self.alpha) * background + self.alpha * frame
+
+        # nothing to compare with on the first snapshot of a camera
+        if background is None:
+            print('Motion pre-filter: first snapshot of {}, passed'.format(deviceSerial))
+            return True
+
+        region = self.regionSlice(deviceSerial)
+        changed = np.abs(frame[region] - background[region]) > self.pixelThreshold
+        areaRatio = changed.mean() if changed.size else 0
+        blobRatio = 0
+        if areaRatio >= self.minAreaRatio:
+            pooled = poolMask(changed)
+            blobRatio = largestBlob(pooled, self.minBlobRatio * pooled.size) / max(pooled.size, 1)
+        passed = bool(areaRatio >= self.minAreaRatio and blobRatio >= self.minBlobRatio)
+
+        print('Motion pre-filter: {} {} (changed area {:.3f}, largest blob {:.3f}, {:.1f} ms)'.format(
+            deviceSerial, 'passed' if passed else 'rejected', areaRatio, blobRatio,
+            (time.perf_counter() - start) * 1000))
+        return passed
@@ -0,0 +1,132 @@
+# in-memory index from car plate to the most recent unserviced order, kept in sync with the order database
+from datetime import datetime
+import threading
+import time
+from plate_matching import PlateMatcher, normalizePlate, canonicalPlate, matchScore
+
+
+# order time in epoch seconds
+def orderTimestamp(order):
+    timeObj = datetime.strptime(order['time'][:19], "%Y-%m-%dT%H:%M:%S")
+    return (timeObj - datetime(1970, 1, 1)).total_seconds()
+
+
+class OrderIndex:
+
+    def __init__(self, ttlSeconds=24 * 3600, bucketSeconds=3600):
+        self.ttlSeconds = ttlSeconds
+        self.bucketSeconds = bucketSeconds
+        self.loaded = False
+        self.byPlate = {}
+        self.byId = {}
+        self.buckets = {}
+        self.canonical = {}
+        self.matcher = PlateMatcher()
+        self.lock = threading.Lock()
+
+    # replace the index content with the given orders
+    def load(self, orders):
+        with self.lock:
+            self.byPlate = {}
+            self.byId = {}
+            self.buckets = {}
+            self.canonical = {}
+            self.matcher = PlateMatcher()
+            for order in orders:
+                self._upsert(order)
+            self.loaded = True
+        self.expire()
+
+    # add or update an order, a serviced order leaves the index
+    def upsert(self, order):
+        with self.lock:
+            self._upsert(order)
+
+    def _upsert(self, order):
+        self._remove(order['id'])
+        if order.get('serviced') or order.get('car_plate') is None:
+            return
+
+        plate = normalizePlate(order['car_plate'])
+        bucket = int(orderTimestamp(order) // self.bucketSeconds)
+        if plate not in self.byPlate:
+            self._addPlate(plate)
+        self.byPlate.setdefault(plate, {})[order['id']] = order
+        self.byId[order['id']] = (plate, bucket)
+        self.buckets.setdefault(bucket, set()).add(order['id'])
+
+    def remove(self, orderId):
+        with self.lock:
+            self._remove(orderId)
+
+    def _remove(self, orderId):
+        if orderId not in self.byId:
+            return
+        plate, bucket = self.byId.pop(orderId)
+        del self.byPlate[plate][orderId]
+        if not self.byPlate[plate]:
+            del self.byPlate[plate]
+            self._removePlate(plate)
+        self.buckets[bucket].discard(orderId)
+        if not self.buckets[bucket]:
+            del self.buckets[bucket]
+
+    # several order plates can share the same canonical plate
+    def _addPlate(self, plate):
+        canonical = canonicalPlate(plate)
+        self.canonical.setdefault(canonical, set()).add(plate)
+        self.matcher.add(canonical)
+
+    def _removePlate(self, plate):
+        canonical = canonicalPlate(plate)
+        self.canonical[canonical].discard(plate)
+        if not self.canonical[canonical]:
+            del self.canonical[canonical]
+            self.matcher.remove(canonical)
+
+    # most recent unserviced order of the plates close to an OCR plate, best score first
+    def match(self, plate, maxDistance=1):
+        with self.lock:
+            return self._match(plate, maxDistance)
+
+    # best match of each plate in a single probe of the index, None for the plates without match
+    def matchMany(self, plates, maxDistance=1):
+        with self.lock:
+            found = {}
+            for plate in plates:
+                matches = self._match(plate, maxDistance)
+                found[plate] = matches[0] if matches else None
+            return found
+
+    def _match(self, plate, maxDistance):
+        matches = []
+        for distance, canonical in self.matcher.search(canonicalPlate(plate), maxDistance):
+            for orderPlate in self.canonical[canonical]:
+                orders = self.byPlate[orderPlate]
+                matches.append({
+                    'order': orders[max(orders)],
+                    'score': matchScore(plate, orderPlate, distance),
+                    'distance': distance
+                })
+        matches.sort(key=lambda match: -match['score'])
+        return matches
+
+    # most recent unserviced order of a plate, None if there is no match
+    def get(self, plate):
+        with self.lock:
+            orders = self.byPlate.get(normalizePlate(plate))
+            if not orders:
+                return None
+            return orders[max(orders)]
+
+    # drop the orders whose time bucket is older than the ttl
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        oldest = int((now - self.ttlSeconds) // self.bucketSeconds)
+        with self.lock:
+            for bucket in [b for b in self.buckets if b < oldest]:
+                for orderId in list(self.buckets[bucket]):
+                    self._remove(orderId)
+
+    def __len__(self):
+        return len(self.byId)
@@ -0,0 +1,105 @@
+# OCR tolerant car plate matching: plates are compared in a canonical form, then by edit distance through a bigram index
+from collections import Counter
+from itertools import chain
+
+# plate as used for the index lookups: no whitespace, upper case
+def normalizePlate(plate):
+    return ''.join(plate.split()).upper()
+
+
+# characters the OCR mixes up, mapped to a single canonical character
+CONFUSIONS = str.maketrans({'O': '0', 'Q': '0', 'D': '0',
+                            'I': '1', 'L': '1',
+                            'B': '8', 'S': '5', 'Z': '2'})
+
+
+# plate with the OCR confusions removed, "MY7O BMW" and "MY70BMW" give the same canonical plate
+def canonicalPlate(plate):
+    return normalizePlate(plate).translate(CONFUSIONS)
+
+
+# levenshtein distance between two plates, stops early once it is above maxDistance
+def editDistance(a, b, maxDistance=None):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        if maxDistance is not None and min(current) > maxDistance:
+            return maxDistance + 1
+        previous = current
+    return previous[-1]
+
+
+# similarity between 0 and 1 of an OCR plate and an order plate
+# a plate that only matches through the OCR confusions scores a bit lower than an exact one
+def matchScore(plate, orderPlate, distance):
+    length = max(len(canonicalPlate(plate)), len(canonicalPlate(orderPlate)), 1)
+    if normalizePlate(plate) != normalizePlate(orderPlate):
+        distance += 0.5
+    return max(0.0, 1 - distance / length)
+
+
+# padded bigrams of a plate, "^MY" ... "W$"
+def plateGrams(plate):
+    padded = '^' + plate + '$'
+    return [padded[i:i + 2] for i in range(len(padded) - 1)]
+
+
+# bigram index of canonical plates
+# a plate within edit distance k of the query shares at least len + 1 - 2k bigrams with it,
+# so only the plates reaching that count are compared with the full edit distance
+class PlateMatcher:
+
+    def __init__(self):
+        self.grams = {}
+        self.plates = set()
+
+    def add(self, plate):
+        if plate in self.plates:
+            return
+        self.plates.add(plate)
+        for gram in set(plateGrams(plate)):
+            self.grams.setdefault(gram, set()).add(plate)
+
+    def remove(self, plate):
+        if plate not in self.plates:
+            return
+        self.plates.discard(plate)
+        for gram in set(plateGrams(plate)):
+            self.grams[gram].discard(plate)
+            if not self.grams[gram]:
+                del self.grams[gram]
+
+    # plates within maxDistance of the given one, as (distance, plate) sorted by distance
+    def search(self, plate, maxDistance=1):
+        counts = Counter(chain.from_iterable(
+            self.grams.get(gram, ()) for gram in plateGrams(plate)))
+
+        # candidates by decreasing shared bigrams, no need to look past the lowest possible threshold
+        found = []
+        for candidate, count in counts.most_common():
+            if count < len(plate) + 1 - 2 * maxDistance:
+                break
+            if abs(len(candidate) - len(plate)) > maxDistance:
+                continue
+            if count < max(len(candidate), len(plate)) + 1 - 2 * maxDistance:
+                continue
+            distance = editDistance(plate, candidate, maxDistance)
+            if distance <= maxDistance:
+                found.append((distance, candidate))
+
+        # a short plate can match without sharing any bigram
+        if len(plate) + 1 <= 2 * maxDistance:
+            found.extend((editDistance(plate, candidate, maxDistance), candidate)
+                         for candidate in self.plates if candidate not in counts)
+            found = [(d, c) for d, c in found if d <= maxDistance]
+
+        found.sort()
+        return found
+
+    def __len__(self):
+        return len(self.plates)
@@ -0,0 +1,246 @@
+# google vision: labels and plate candidates of snapshots given as bytes, urls or local files
+# nothing is started nor written when imported, reprocess_snapshots.py uses it without the flask server functions
+from dotenv import load_dotenv
+from google.cloud import vision
+from vision_cache import VisionCache
+import os
+import io
+
+# search .env and load environment variable
+load_dotenv()
+
+# google Vision API client instance
+client = vision.ImageAnnotatorClient()
+
+# labels that make a snapshot relevant for plate detection
+LABEL_LIST = ['Vehicle', 'Vehicle registration plate', 'Car']
+
+# max number of images google vision accepts in a single batch request
+VISION_BATCH_SIZE = 16
+LABEL_FEATURE = vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION)
+TEXT_FEATURE = vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)
+
+# vision results by image hash and feature: in memory, and on disk if VISION_CACHE_DB is a sqlite file path
+visionCache = VisionCache(
+    maxEntries=int(os.getenv('VISION_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('VISION_CACHE_TTL', 24 * 3600)),
+    dbPath=os.getenv('VISION_CACHE_DB'),
+    maxDiskEntries=int(os.getenv('VISION_CACHE_DB_MAX', 100000)))
+
+
+# filter the labels from a pre-defined label list
+def filterLabels(labels, lst):
+    for label in labels:
+        for part in lst:
+            if label == part:
+                print('There is at least a relevant label in the snapshot = ', label)
+                return True
+    print('There is no relevant label in the snapshot')
+    return False
+
+
+# the results are cached by image hash (url for the URI functions) and feature, see visionCache
+# detect text from image url
+def detectTextURI(url):
+    digest = visionCache.digest(url)
+    detectedPlate = visionCache.get(digest, 'text')
+    if detectedPlate is None:
+        response = client.text_detection(image=toVisionImage(url))
+        detectedPlate = platesFromTexts(response.text_annotations)
+
+        if response.error.message:
+            print("Car plate detection: Error")
+        else:
+            visionCache.put(digest, 'text', detectedPlate)
+
+    if detectedPlate != []:
+        print("Car plate detected = ", detectedPlate)
+
+    return detectedPlate
+
+
+# build a vision image from snapshot bytes or a snapshot url
+def toVisionImage(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return vision.Image(content=bytes(source))
+
+    image = vision.Image()
+    image.source.image_uri = source
+    return image
+
+
+# extract the plate candidates from text annotations
+def platesFromTexts(texts):
+    detectedPlate = []
+    for text in texts:
+        if '\n' in text.description:
+            detectedPlate.append(text.description.replace('\n', ''))
+    return detectedPlate
+
+
+# label descriptions and highest confidence score among the relevant labels (0 if there is none)
+def labelsFromAnnotations(labels):
+    scores = [label.score for label in labels if label.description in LABEL_LIST]
+    return {
+        'labels': [label.description for label in labels],
+        'labelScore': max(scores) if scores else 0
+    }
+
+
+# send the requests to google vision, split in chunks of the max batch size
+def batchAnnotate(annotateRequests):
+    responses = []
+    for i in range(0, len(annotateRequests), VISION_BATCH_SIZE):
+        batch = client.batch_annotate_images(
+            requests=annotateRequests[i:i + VISION_BATCH_SIZE])
+        responses.extend(batch.responses)
+    return responses
+
+
+# annotate the snapshots with the features each one still misses, then cache the results
+def annotateMissing(sources, digests, results, index, features):
+    annotateRequests = []
+    for i in index:
+        imageFeatures = [feature for name, feature in features
+                         if results[i][name] is None]
+        annotateRequests.append(vision.AnnotateImageRequest(
+            image=toVisionImage(sources[i]), features=imageFeatures))
+
+    for i, response in zip(index, batchAnnotate(annotateRequests)):
+        result = results[i]
+        if response.error.message:
+            print("Snapshot annotation: Error = ", response.error.message)
+            result['error'] = response.error.message
+            continue
+
+        for name, feature in features:
+            if result[name] is not None:
+                continue
+            if name == 'labels':
+                labels = labelsFromAnnotations(response.label_annotations)
+                result.update(labels)
+                visionCache.put(digests[i], 'labels', labels)
+            else:
+                result['plates'] = platesFromTexts(response.text_annotations)
+                visionCache.put(digests[i], 'text', result['plates'])
+
+
+# label and text detection of one or more snapshots (bytes or urls) in a single vision request
+# if ocrMinScore is given, the text detection only runs on snapshots whose relevant label reaches that score
+def annotateImages(sources, ocrMinScore=None):
+    digests = [visionCache.digest(source) for source in sources]
+
+    results = []
+    for digest in digests:
+        result = {'labels': None, 'labelScore': 0, 'plates': None, 'error': ''}
+        labels = visionCache.get(digest, 'labels')
+        if labels is not None:
+            result.update(labels)
+        result['plates'] = visionCache.get(digest, 'text')
+        results.append(result)
+
+    if ocrMinScore is None:
+        features = [('labels', LABEL_FEATURE), ('plates', TEXT_FEATURE)]
+    else:
+        features = [('labels', LABEL_FEATURE)]
+
+    index = [i for i, result in enumerate(results)
+             if any(result[name] is None for name, feature in features)]
+    annotateMissing(sources, digests, results, index, features)
+
+    for result in results:
+        if result['labels'] is None:
+            result['labels'] = []
+        result['relevant'] = filterLabels(result['labels'], LABEL_LIST)
+
+    # second round trip only for the snapshots confident enough to contain a vehicle
+    if ocrMinScore is not None:
+        index = [i for i, result in enumerate(results)
+                 if result['relevant'] and result['labelScore'] >= ocrMinScore and result['plates'] is None]
+        annotateMissing(sources, digests, results, index,
+                        [('plates', TEXT_FEATURE)])
+
+    for result in results:
+        if result['plates'] is None:
+            result['plates'] = []
+        if result['plates'] != []:
+            print("Car plate detected = ", result['plates'])
+
+    return results
+
+
+# detect label from image url
+def detectLabelsURI(url):
+    digest = visionCache.digest(url)
+    labels = visionCache.get(digest, 'labels')
+    if labels is None:
+        response = client.label_detection(image=toVisionImage(url))
+        labels = labelsFromAnnotations(response.label_annotations)
+
+        if response.error.message:
+            print("Label detection: Error")
+        else:
+            visionCache.put(digest, 'labels', labels)
+
+    detectedLabel = labels['labels']
+
+    if detectedLabel != []:
+        print("Snapshot labels detected = ", detectedLabel)
+
+    return detectedLabel
+
+
+# detect image from local path
+def detectTextLocal(path):
+
+    with io.open(path, 'rb') as image_file:
+        content = image_file.read()
+
+    digest = visionCache.digest(content)
+    detectedPlate = visionCache.get(digest, 'text')
+    if detectedPlate is None:
+        imageLocal = vision.Image(content=content)
+
+        response = client.text_detection(image=imageLocal)
+        detectedPlate = platesFromTexts(response.text_annotations)
+
+        if response.error.message:
+            raise Exception(
+                '{}\nFor more info on error messages, check: '
+                'https://cloud.google.com/apis/design/errors'.format(
+                    response.error.message))
+        visionCache.put(digest, 'text', detectedPlate)
+
+    if detectedPlate != []:
+        print("Car plate detected = ", detectedPlate)
+
+    return detectedPlate
+
+
+# detect label from local path
+def detectLabelslocal(path):
+
+    with io.open(path, 'rb') as image_file:
+        content = image_file.read()
+
+    digest = visionCache.digest(content)
+    labels = visionCache.get(digest, 'labels')
+    if labels is None:
+        imageLocal = vision.Image(content=content)
+
+        response = client.label_detection(image=imageLocal)
+        labels = labelsFromAnnotations(response.label_annotations)
+
+        if response.error.message:
+            raise Exception(
+                '{}\nFor more info on error messages, check: '
+                'https://cloud.google.com/apis/design/errors'.format(
+                    response.error.message))
+        visionCache.put(digest, 'labels', labels)
+
+    detectedLabel = labels['labels']
+
+    if detectedLabel != []:
+        print("Snapshot labels detected = ", detectedLabel)
+
+    return detectedLabel
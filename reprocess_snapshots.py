@@ -0,0 +1,223 @@
+# run the plate recognition again over saved snapshots, e.g. after changing LABEL_LIST or the plate matching rules
+# usage: python reprocess_snapshots.py SNAPSHOT_DIR [--output results.jsonl] [--workers 8] [--match]
+#        python reprocess_snapshots.py --manifest snapshots.txt [--output results.jsonl]
+# the manifest lists one path per line, or one JSON object per line with a "path" field and fields copied to the result
+# the output is written as the snapshots are done and is also the checkpoint: run the same command again to resume,
+# the snapshots already done are skipped and the ones that failed are tried again (the last line of a path wins)
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import Counter
+from google.api_core import exceptions as apiExceptions
+from plate_vision import detectLabelslocal, detectTextLocal, filterLabels, LABEL_LIST
+
+# order lookup of --match, see main()
+getOrders = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# google vision errors worth trying again after a pause
+TRANSIENT_ERRORS = (apiExceptions.ServiceUnavailable, apiExceptions.DeadlineExceeded,
+                    apiExceptions.TooManyRequests, apiExceptions.InternalServerError)
+
+
+# snapshots to process: (path, fields copied to the result), in a stable order
+def listSnapshots(directory=None, manifest=None):
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                fields = json.loads(line) if line.startswith('{') else {'path': line}
+                path = fields.pop('path')
+                yield os.path.normpath(os.path.join(base, path)), fields
+        return
+
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.normpath(os.path.join(root, name)), {}
+
+
+# paths already processed without error, from the results of a previous run
+def readCheckpoint(output):
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # last line cut by an interrupted run
+                continue
+            if result.get('error'):
+                done.discard(result['path'])
+            else:
+                done.add(result['path'])
+    return done
+
+
+# an interrupted run may have left half a line: the next result starts on its own line
+def openOutput(output):
+    if os.path.exists(output) and os.path.getsize(output) > 0:
+        with open(output, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            complete = f.read(1) == b'\n'
+        outputFile = open(output, 'a')
+        if not complete:
+            outputFile.write('\n')
+        return outputFile
+    return open(output, 'w')
+
+
+# labels, then plates of the relevant snapshots, like the motion alert processing
+def recognize(path, alwaysText):
+    labels = detectLabelslocal(path)
+    relevant = filterLabels(labels, LABEL_LIST)
+    plates = detectTextLocal(path) if relevant or alwaysText else []
+    return {'labels': labels, 'relevant': relevant, 'plates': plates}
+
+
+def processSnapshot(path, fields, args):
+    start = time.perf_counter()
+    result = dict(fields, path=path)
+    for attempt in range(args.retries + 1):
+        try:
+            result.update(recognize(path, args.always_text))
+            if args.match and result['plates']:
+                orders = getOrders(result['plates'])
+                result['orders'] = {plate: order.get('id') for plate, order in orders.items() if order != []}
+            result['error'] = None
+            break
+        except TRANSIENT_ERRORS as e:
+            result['error'] = '{}: {}'.format(type(e).__name__, e)
+            if attempt < args.retries:
+                time.sleep(args.retry_delay * 2 ** attempt)
+        except Exception as e:
+            result['error'] = '{}: {}'.format(type(e).__name__, e)
+            break
+    result['ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+class Summary:
+
+    def __init__(self):
+        self.skipped = 0
+        self.start = time.monotonic()
+        self.lastProgress = self.start
+        self.timings = []
+        self.errors = Counter()
+        self.relevant = 0
+        self.withPlates = 0
+        self.matched = 0
+
+    def add(self, result):
+        self.timings.append(result['ms'])
+        if result['error']:
+            self.errors[result['error'].split(':')[0]] += 1
+            return
+        self.relevant += result['relevant']
+        self.withPlates += result['plates'] != []
+        self.matched += bool(result.get('orders'))
+
+    def rate(self):
+        return len(self.timings) / max(time.monotonic() - self.start, 1e-9)
+
+    def progress(self, every=10):
+        if time.monotonic() - self.lastProgress >= every:
+            self.lastProgress = time.monotonic()
+            print('Reprocessed {} snapshots ({:.1f}/s), {} errors'.format(
+                len(self.timings), self.rate(), sum(self.errors.values())), file=sys.stderr)
+
+    def report(self):
+        timings = sorted(self.timings)
+
+        def percentile(share):
+            return timings[min(len(timings) - 1, int(len(timings) * share))] if timings else 0
+
+        print('\nsnapshots {}   skipped (done before) {}   in {:.1f} s   {:.1f} snapshots/s'.format(
+            len(timings), self.skipped, time.monotonic() - self.start, self.rate()), file=sys.stderr)
+        print('per snapshot p50 {:.0f} ms   p95 {:.0f} ms   p99 {:.0f} ms'.format(
+            percentile(0.5), percentile(0.95), percentile(0.99)), file=sys.stderr)
+        print('relevant {}   with plates {}   matched an order {}'.format(
+            self.relevant, self.withPlates, self.matched), file=sys.stderr)
+        print('errors {}{}'.format(sum(self.errors.values()), ''.join(
+            '\n  {:<28} {}'.format(name, count) for name, count in self.errors.most_common())), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', nargs='?', help='directory searched for .jpg, .jpeg and .png snapshots')
+    parser.add_argument('--manifest', help='file listing the snapshots instead of a directory')
+    parser.add_argument('--output', default='reprocessed.jsonl')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('REPROCESS_WORKERS', 8)),
+                        help='snapshots analyzed at once')
+    parser.add_argument('--match', action='store_true', help='look up the order of each plate')
+    parser.add_argument('--always-text', action='store_true', help='detect plates in snapshots without a vehicle')
+    parser.add_argument('--retries', type=int, default=3, help='tries again on Google Vision outages')
+    parser.add_argument('--retry-delay', type=float, default=1.0)
+    args = parser.parse_args()
+    if bool(args.directory) == bool(args.manifest):
+        parser.error('give either a snapshot directory or --manifest')
+
+    # the order lookup needs the database and order index of the flask server functions, imported for --match only
+    if args.match:
+        global getOrders
+        from functions import getOrders, loadOrderIndex, STORAGE_ERRORS
+        try:
+            loadOrderIndex()
+        except STORAGE_ERRORS as e:
+            print('Could not load the order index, orders are searched in DB = ', e)
+
+    done = readCheckpoint(args.output)
+    summary = Summary()
+    outputFile = openOutput(args.output)
+
+    # at most a few snapshots per worker are queued, the list of snapshots is never held in memory
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='reprocess')
+    running = set()
+    try:
+        for path, fields in listSnapshots(args.directory, args.manifest):
+            if path in done:
+                summary.skipped += 1
+                continue
+            if len(running) >= args.workers * 2:
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                writeResults(finished, outputFile, summary)
+            running.add(executor.submit(processSnapshot, path, fields, args))
+        while running:
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            writeResults(finished, outputFile, summary)
+    except KeyboardInterrupt:
+        # the snapshots being analyzed are still written, run the same command again to resume
+        print('\nInterrupted, finishing the snapshots in progress', file=sys.stderr)
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=True)
+        writeResults([future for future in running if not future.cancelled()], outputFile, summary)
+    finally:
+        executor.shutdown(wait=True)
+        outputFile.close()
+    summary.report()
+
+
+def writeResults(finished, outputFile, summary):
+    for future in finished:
+        result = future.result()
+        outputFile.write(json.dumps(result) + '\n')
+        summary.add(result)
+    outputFile.flush()
+    summary.progress()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# per camera history of snapshot perceptual hashes: a snapshot looking like a recent one reuses its result
+from collections import deque
+from PIL import Image
+import threading
+import time
+import io
+
+
+# 64 bit difference hash: compares each pixel with its right neighbour on a 9x8 grayscale thumbnail
+# region: [left, top, right, bottom] in fractions of the frame, only this part (e.g. the bay) is hashed
+def dHash(content, region=None):
+    left, top, right, bottom = region or [0, 0, 1, 1]
+    image = Image.open(io.BytesIO(content))
+    image.draft('L', (int(64 / max(right - left, 0.01)) + 1, int(64 / max(bottom - top, 0.01)) + 1))
+    image = image.convert('L')
+    if region is not None:
+        width, height = image.size
+        image = image.crop((int(left * width), int(top * height), int(right * width), int(bottom * height)))
+    pixels = list(image.resize((9, 8), Image.BILINEAR).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hammingDistance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class SnapshotDedupe:
+
+    # regions: {deviceSerial: [left, top, right, bottom]} hashed instead of the whole frame, so that a car in the bay
+    # is not hidden by an unchanged background
+    def __init__(self, maxDistance=6, window=300, history=20, regions=None):
+        self.maxDistance = maxDistance
+        self.regions = regions or {}
+        self.window = window
+        self.history = history
+        self.snapshots = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # result ({'relevant', 'plates'}) of a recent snapshot of the camera close enough to this one, None if there is none
+    # snapshots stored by the same job (its own retries) are ignored
+    # the hash is returned as well so the caller can store the new result without hashing again
+    def lookup(self, deviceSerial, content, jobId=None):
+        snapHash = dHash(content, self.regions.get(deviceSerial))
+        now = time.time()
+        with self.lock:
+            for storedAt, storedJob, storedHash, result in reversed(self.snapshots.get(deviceSerial, ())):
+                if storedJob == jobId and jobId is not None:
+                    continue
+                if now - storedAt <= self.window and hammingDistance(snapHash, storedHash) <= self.maxDistance:
+                    self.hits += 1
+                    return snapHash, dict(result)
+            self.misses += 1
+        return snapHash, None
+
+    # only the google vision results without error are stored
+    def store(self, deviceSerial, snapHash, annotation, jobId=None):
+        result = {'relevant': annotation['relevant'], 'plates': annotation['plates']}
+        with self.lock:
+            if deviceSerial not in self.snapshots:
+                self.snapshots[deviceSerial] = deque(maxlen=self.history)
+            self.snapshots[deviceSerial].append(
+                (time.time(), jobId, snapHash, result))
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
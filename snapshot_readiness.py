@@ -0,0 +1,41 @@
+# learns how long each camera needs before a generated snapshot url becomes accessible
+from collections import deque
+import threading
+
+
+class ReadinessTracker:
+
+    def __init__(self, defaultDelay=1.0, minDelay=0.25, maxDelay=4.0, deadline=15.0, history=50):
+        self.defaultDelay = defaultDelay
+        self.minDelay = minDelay
+        self.maxDelay = maxDelay
+        self.deadline = deadline
+        self.history = history
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    # store the observed time-to-ready of a snapshot, in seconds
+    # the snapshot became ready between the last failed probe and the successful one, so the caller passes the middle of both
+    def record(self, deviceSerial, seconds):
+        with self.lock:
+            if deviceSerial not in self.samples:
+                self.samples[deviceSerial] = deque(maxlen=self.history)
+            self.samples[deviceSerial].append(seconds)
+
+    # first probe at the median time-to-ready of the camera
+    def initialDelay(self, deviceSerial):
+        with self.lock:
+            samples = sorted(self.samples.get(deviceSerial, []))
+        if not samples:
+            return self.defaultDelay
+        median = samples[len(samples) // 2]
+        return min(max(median, self.minDelay), self.maxDelay)
+
+    # delays between the probes: the initial delay, then doubled and capped until the deadline
+    def delays(self, deviceSerial):
+        delay = self.initialDelay(deviceSerial)
+        waited = 0
+        while waited + delay <= self.deadline:
+            yield delay
+            waited += delay
+            delay = min(delay * 2, self.maxDelay)
@@ -0,0 +1,117 @@
+# content addressed snapshot archive: each snapshot is stored once under its sha256, in directory/ab/cd/abcd...
+# with a SQLite index telling which snapshots show a camera, time, plate or order, for the audit of past pickups
+from contextlib import contextmanager
+from plate_matching import normalizePlate
+import threading
+import tempfile
+import hashlib
+import sqlite3
+import mmap
+import os
+
+
+class SnapshotStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.index = sqlite3.connect(os.path.join(directory, 'index.sqlite'),
+                                     check_same_thread=False)
+        self.index.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS snapshot (
+                digest BLOB, camera TEXT, time TEXT, plate TEXT, order_id INTEGER, size INTEGER,
+                UNIQUE (digest, camera, time, plate));
+            CREATE INDEX IF NOT EXISTS snapshot_plate ON snapshot (plate, time);
+            CREATE INDEX IF NOT EXISTS snapshot_order ON snapshot (order_id);
+            CREATE INDEX IF NOT EXISTS snapshot_camera ON snapshot (camera, time);
+        ''')
+
+    # path of a blob: two levels of 256 directories keep each directory small
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest[2:4], digest)
+
+    # store snapshot bytes, nothing is written if the same snapshot is already stored, returns the hex digest
+    def put(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        if not os.path.exists(self.path(digest)):
+            self.putStream([content])
+        return digest
+
+    # store a snapshot given as chunks (e.g. a streamed download) without holding it in memory
+    # returns the hex digest, None if the stream is empty
+    def putStream(self, chunks):
+        hasher = hashlib.sha256()
+        size = 0
+        handle, tmpPath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            if size == 0:
+                return None
+            digest = hasher.hexdigest()
+            if not os.path.exists(self.path(digest)):
+                os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+                os.replace(tmpPath, self.path(digest))
+            return digest
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    # index the snapshot under a camera and time, and the plate and order it was matched with
+    # a snapshot without plate is indexed with an empty plate, so that tagging it again adds no entry
+    def tag(self, digest, camera, time, plate=None, orderId=None):
+        size = os.path.getsize(self.path(digest))
+        with self.lock, self.index:
+            self.index.execute(
+                'INSERT INTO snapshot VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (digest, camera, time, plate) '
+                'DO UPDATE SET order_id = coalesce(excluded.order_id, order_id)',
+                (bytes.fromhex(digest), camera, time, normalizePlate(plate) if plate else '', orderId, size))
+
+    # index entries of a plate, order and/or camera, most recent first
+    def find(self, plate=None, orderId=None, camera=None, since=None, until=None, limit=100):
+        conditions, params = [], []
+        if plate is not None:
+            conditions.append('plate = ?')
+            params.append(normalizePlate(plate))
+        if orderId is not None:
+            conditions.append('order_id = ?')
+            params.append(orderId)
+        if camera is not None:
+            conditions.append('camera = ?')
+            params.append(camera)
+        if since is not None:
+            conditions.append('time >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('time <= ?')
+            params.append(until)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        with self.lock:
+            rows = self.index.execute(
+                'SELECT digest, camera, time, plate, order_id, size FROM snapshot' + where +
+                ' ORDER BY time DESC LIMIT ?', params + [limit]).fetchall()
+        return [{'digest': digest.hex(), 'camera': camera, 'time': time, 'plate': plate or None, 'orderId': orderId,
+                 'size': size, 'path': self.path(digest.hex())} for digest, camera, time, plate, orderId, size in rows]
+
+    # the snapshot bytes, memory mapped: only the pages read are loaded, nothing is copied
+    @contextmanager
+    def open(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b''
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def stats(self):
+        with self.lock:
+            blobs, size = self.index.execute(
+                'SELECT count(*), coalesce(sum(size), 0) FROM (SELECT DISTINCT digest, size FROM snapshot)').fetchone()
+            entries = self.index.execute('SELECT count(*) FROM snapshot').fetchone()[0]
+        return {'snapshots': blobs, 'bytes': size, 'entries': entries}
@@ -0,0 +1,92 @@
+# per camera snapshot schedule: seconds after the last motion at which the snapshots are taken
+# learned from the delays at which the plates were first read, stored with the car events
+from collections import deque
+from bisect import bisect_right
+from itertools import combinations
+import threading
+import random
+import math
+
+
+class SnapshotTiming:
+
+    # defaultSchedule: used until a camera has minSamples reads
+    # attemptTime: seconds taken by one snapshot and its analysis, the min gap between two snapshots
+    # missPenalty: seconds added when the plate would only be readable after the last snapshot (manual check)
+    # explore: share of alerts with an earlier first snapshot, to find out whether the bay settles faster
+    def __init__(self, defaultSchedule=(12, 16, 20), minDelay=2, maxAttempts=3, attemptTime=3,
+                 missPenalty=30, minSamples=5, history=100, explore=0.1):
+        self.defaultSchedule = list(defaultSchedule)
+        self.minDelay = minDelay
+        self.maxAttempts = maxAttempts
+        self.attemptTime = attemptTime
+        self.missPenalty = missPenalty
+        self.minSamples = minSamples
+        self.explore = explore
+        self.outcomes = {}
+        self.schedules = {}
+        self.historySize = history
+        self.lock = threading.Lock()
+
+    # past outcomes: the car events holding the camera serial and read delay, a None delay being an alert without read
+    def learn(self, events):
+        for event in sorted(events, key=lambda event: event.get('time') or ''):
+            if event.get('camera') and 'delay' in event:
+                self.record(event['camera'], event['delay'])
+
+    # delay of the snapshot where a plate was first read, None if no plate was read at all
+    def record(self, deviceSerial, delay):
+        with self.lock:
+            if deviceSerial not in self.outcomes:
+                self.outcomes[deviceSerial] = deque(maxlen=self.historySize)
+            self.outcomes[deviceSerial].append(delay)
+            self.schedules.pop(deviceSerial, None)
+
+    def schedule(self, deviceSerial):
+        with self.lock:
+            schedule = self.schedules.get(deviceSerial)
+            if schedule is None:
+                outcomes = self.outcomes.get(deviceSerial, [])
+                reads = [delay for delay in outcomes if delay is not None]
+                if len(reads) < self.minSamples:
+                    schedule = self.defaultSchedule
+                else:
+                    schedule = self.optimize(reads, 1 - len(reads) / len(outcomes))
+                self.schedules[deviceSerial] = schedule
+
+        if random.random() < self.explore and schedule[0] - self.attemptTime > self.minDelay:
+            return [random.uniform(self.minDelay, schedule[0] - self.attemptTime)] + schedule
+        return list(schedule)
+
+    # schedule minimizing the mean seconds to a read plate, or to the last snapshot for the alerts never read
+    # the first snapshot able to read a car is the first one after its read delay, so the
+    # candidate times are the observed delays themselves, rounded up to the second
+    def optimize(self, reads, unreadShare):
+        reads = sorted(reads)
+        candidates = sorted(set([max(self.minDelay, math.ceil(delay)) for delay in reads]))
+        readCount = len(reads)
+        # alerts never read, in proportion to the read ones
+        unreadCount = readCount * unreadShare / (1 - unreadShare) if unreadShare < 1 else readCount
+
+        best, bestCost = self.defaultSchedule, None
+        for attempts in range(1, self.maxAttempts + 1):
+            for schedule in combinations(candidates, attempts):
+                if any(b - a < self.attemptTime for a, b in zip(schedule, schedule[1:])):
+                    continue
+                cost, covered = 0, 0
+                for at in schedule:
+                    upTo = bisect_right(reads, at)
+                    cost += (upTo - covered) * at
+                    covered = upTo
+                cost += (readCount - covered) * (schedule[-1] + self.missPenalty)
+                cost += unreadCount * schedule[-1]
+                if bestCost is None or cost < bestCost:
+                    best, bestCost = list(schedule), cost
+        return best
+
+    def stats(self):
+        with self.lock:
+            return {deviceSerial: {'schedule': self.schedules.get(deviceSerial),
+                                   'reads': len([delay for delay in outcomes if delay is not None]),
+                                   'unread': len([delay for delay in outcomes if delay is None])}
+                    for deviceSerial, outcomes in self.outcomes.items()}
@@ -0,0 +1,246 @@
+# order and car event storage: JSON-server over HTTP, or an embedded SQLite database
+# both backends return plain dicts shaped like the JSON-server records
+import threading
+import requests
+import sqlite3
+import json
+import os
+
+
+# storage through the JSON-server REST API
+class JsonServerStore:
+
+    def __init__(self, dbClient):
+        self.dbClient = dbClient
+
+    # store a car event, returns the stored record or None
+    def addCarEvent(self, event):
+        response = self.dbClient.postCarEvent(event)
+        return response.json() if response.status_code == 201 else None
+
+    # JSON-server has no bulk insert: the events are posted one by one on the pooled connection
+    # returns how many of them were stored, stopping at the first failure, so that the stored ones are not posted again
+    def addCarEvents(self, events):
+        for i, event in enumerate(events):
+            try:
+                if self.addCarEvent(event) is None:
+                    return i
+            except requests.RequestException as e:
+                print('Could not store the car event = ', e)
+                return i
+        return len(events)
+
+    # most recent order of a plate, None if there is none
+    def latestOrder(self, plate):
+        response = self.dbClient.getLatestOrder(plate)
+        if response.status_code != 200 or response.json() == []:
+            return None
+        return response.json()[0]
+
+    # most recent order of each plate in one request, plates without order are left out
+    def latestOrders(self, plates):
+        response = self.dbClient.getLatestOrders(plates)
+        if response.status_code != 200:
+            return None
+        found = {}
+        for order in response.json():
+            found.setdefault(order['car_plate'], order)
+        return found
+
+    # orders placed since the given time and not serviced, an order without serviced field is not serviced
+    def openOrders(self, since):
+        response = self.dbClient.getOrdersSince(since)
+        if response.status_code != 200:
+            return None
+        return [order for order in response.json() if not order.get('serviced')]
+
+    # update the serviced status, returns the updated order, None if there is no such order
+    def setServiced(self, orderId, serviced):
+        response = self.dbClient.patchOrder(orderId, {"serviced": serviced})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    # the ordering app writes its orders to JSON-server itself
+    def ingestOrder(self, order):
+        return order
+
+    def recentCarEvents(self, limit):
+        response = self.dbClient.getRecentCarEvents(limit)
+        return response.json() if response.status_code == 200 else None
+
+    def carEventsBefore(self, time):
+        response = self.dbClient.getCarEventsBefore(time)
+        response.raise_for_status()
+        return response.json()
+
+    # JSON-server rewrites its file on every delete, use JsonFileStore to compact a large backlog offline
+    def deleteCarEvents(self, eventIds):
+        for eventId in eventIds:
+            self.dbClient.deleteCarEvent(eventId).raise_for_status()
+        return len(eventIds)
+
+    # the file of JSON-server is rewritten without the deleted events already
+    def compact(self):
+        pass
+
+
+# the JSON-server database file itself, for maintenance while JSON-server is stopped
+class JsonFileStore:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path) as f:
+            self.data = json.load(f)
+
+    def carEventsBefore(self, time):
+        return [event for event in self.data.get('car_event', []) if event.get('time', '') <= time]
+
+    def deleteCarEvents(self, eventIds):
+        eventIds = set(eventIds)
+        self.data['car_event'] = [event for event in self.data.get('car_event', [])
+                                  if event.get('id') not in eventIds]
+        return len(eventIds)
+
+    # write the file again, through a temporary file so an interrupted run keeps the old one
+    def compact(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+
+# storage in a SQLite file in WAL mode, one connection per thread
+# each commit is synced to disk, the car events are committed in batches by the write-behind buffer
+# the indexed fields have their own column, the full record is kept as JSON
+class SqliteStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.connection().executescript('''
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS "order" (
+                id INTEGER PRIMARY KEY, car_plate TEXT, serviced INTEGER, data TEXT);
+            CREATE INDEX IF NOT EXISTS order_car_plate ON "order" (car_plate, id);
+            CREATE INDEX IF NOT EXISTS order_serviced ON "order" (serviced);
+            CREATE TABLE IF NOT EXISTS car_event (
+                id INTEGER PRIMARY KEY, time TEXT, plate TEXT, location TEXT, data TEXT);
+            CREATE INDEX IF NOT EXISTS car_event_time ON car_event (time);
+        ''')
+
+    def connection(self):
+        if not hasattr(self.local, 'db'):
+            self.local.db = sqlite3.connect(self.path, timeout=10)
+            self.local.db.execute('PRAGMA synchronous=FULL')
+        return self.local.db
+
+    def addCarEvent(self, event):
+        db = self.connection()
+        with db:
+            return self._insertCarEvent(db, event)
+
+    # all the events in one transaction, so one sync to disk per batch
+    def addCarEvents(self, events):
+        db = self.connection()
+        with db:
+            for event in events:
+                self._insertCarEvent(db, event)
+        return len(events)
+
+    def _insertCarEvent(self, db, event):
+        cursor = db.execute('INSERT INTO car_event (id, time, plate, location, data) VALUES (?, ?, ?, ?, ?)',
+                            (event.get('id'), event.get('time'), event.get('plate'),
+                             event.get('location'), '{}'))
+        stored = dict(event, id=cursor.lastrowid)
+        db.execute('UPDATE car_event SET data = ? WHERE id = ?',
+                   (json.dumps(stored), cursor.lastrowid))
+        return stored
+
+    def latestOrder(self, plate):
+        row = self.connection().execute('SELECT data FROM "order" WHERE car_plate = ? ORDER BY id DESC LIMIT 1',
+                                        (plate,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def latestOrders(self, plates):
+        plates = list(plates)
+        rows = self.connection().execute(
+            'SELECT car_plate, data FROM "order" WHERE car_plate IN ({}) ORDER BY id DESC'.format(
+                ','.join('?' * len(plates))), plates).fetchall()
+        found = {}
+        for plate, data in rows:
+            if plate not in found:
+                found[plate] = json.loads(data)
+        return found
+
+    def openOrders(self, since):
+        rows = self.connection().execute(
+            'SELECT data FROM "order" WHERE serviced = 0').fetchall()
+        orders = [json.loads(row[0]) for row in rows]
+        return [order for order in orders if (order.get('time') or '') >= since]
+
+    def setServiced(self, orderId, serviced):
+        # the cards without order (no match, no plate) carry a placeholder id
+        try:
+            orderId = int(orderId)
+        except (TypeError, ValueError):
+            return None
+        db = self.connection()
+        with db:
+            row = db.execute('SELECT data FROM "order" WHERE id = ?',
+                             (orderId,)).fetchone()
+            if row is None:
+                return None
+            order = dict(json.loads(row[0]), serviced=serviced)
+            db.execute('UPDATE "order" SET serviced = ?, data = ? WHERE id = ?',
+                       (int(serviced), json.dumps(order), orderId))
+        return order
+
+    # create (no id) or replace (with id) an order, returns the stored order
+    def ingestOrder(self, order):
+        db = self.connection()
+        with db:
+            self._saveOrder(db, order)
+        return order
+
+    def _saveOrder(self, db, order):
+        if order.get('id') is None:
+            cursor = db.execute('INSERT INTO "order" (car_plate, serviced, data) VALUES (?, ?, ?)',
+                                (order.get('car_plate'), int(bool(order.get('serviced'))), '{}'))
+            order['id'] = cursor.lastrowid
+        db.execute('INSERT OR REPLACE INTO "order" (id, car_plate, serviced, data) VALUES (?, ?, ?, ?)',
+                   (order['id'], order.get('car_plate'), int(bool(order.get('serviced'))), json.dumps(order)))
+
+    def recentCarEvents(self, limit):
+        rows = self.connection().execute(
+            'SELECT data FROM car_event ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def carEventsBefore(self, time):
+        rows = self.connection().execute(
+            'SELECT data FROM car_event WHERE time <= ? ORDER BY time', (time,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def deleteCarEvents(self, eventIds):
+        db = self.connection()
+        with db:
+            db.executemany('DELETE FROM car_event WHERE id = ?',
+                           [(eventId,) for eventId in eventIds])
+        return len(eventIds)
+
+    # give the deleted pages back to the file system, and empty the WAL file
+    def compact(self):
+        db = self.connection()
+        db.execute('VACUUM')
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    # import the order and car_event collections of a JSON-server database, e.g. db_server.json
+    def importJson(self, data):
+        db = self.connection()
+        with db:
+            for order in data.get('order', []):
+                self._saveOrder(db, dict(order))
+            db.executemany('INSERT OR REPLACE INTO car_event (id, time, plate, location, data) VALUES (?, ?, ?, ?, ?)',
+                           [(event['id'], event.get('time'), event.get('plate'), event.get('location'),
+                             json.dumps(event)) for event in data.get('car_event', [])])
+        return len(data.get('order', [])), len(data.get('car_event', []))
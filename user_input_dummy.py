@@ -1,5 +1,6 @@
 # When the user make an order from app > post JSON payload to JSON server DB
 
+from datetime import datetime
 import requests
 import json
 import os
@@ -8,20 +9,34 @@ from dotenv import load_dotenv
 # search .env and load environment variable
 load_dotenv()
 DB_HOST = os.getenv('DB_HOST')
+FLASK_URL = os.getenv('FLASK_URL', 'http://127.0.0.1:5000')
+DB_BACKEND = os.getenv('DB_BACKEND', 'json-server')
+ORDER_SHARED_KEY = os.getenv('ORDER_SHARED_KEY', '')
 
-url = DB_HOST+"/order"
+# with the SQLite backend, the flask server stores the order itself
+if DB_BACKEND == 'sqlite':
+    url = FLASK_URL+"/order_event"
+else:
+    url = DB_HOST+"/order"
 
 payload = json.dumps({
     "customer": "Bob",
     "menu": "Fries",
     "qty": 3,
     "car_plate": "MY70 BMW",
-    "time": "2021-04-23T08:09:46Z"
+    "serviced": False,
+    "time": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
 })
 headers = {
     'Content-Type': 'application/json'
 }
 
-response = requests.request("POST", url, headers=headers, data=payload)
+response = requests.request("POST", url, headers=dict(headers, **{'X-Shared-Secret': ORDER_SHARED_KEY}),
+                            data=payload)
 
 print(response.text)
+
+# keep the order index of the flask server in sync with the new order
+if response.status_code == 201 and DB_BACKEND != 'sqlite':
+    requests.request("POST", FLASK_URL+"/order_event",
+                     headers=dict(headers, **{'X-Shared-Secret': ORDER_SHARED_KEY}), data=response.text)
@@ -0,0 +1,87 @@
+# google vision results cached by SHA-256 of the image and feature: an in-memory LRU, optionally backed by SQLite
+from collections import OrderedDict
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+
+
+class VisionCache:
+
+    def __init__(self, maxEntries=1024, ttl=24 * 3600, dbPath=None, maxDiskEntries=100000):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.maxDiskEntries = maxDiskEntries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.puts = 0
+
+        self.db = None
+        if dbPath:
+            self.db = sqlite3.connect(dbPath, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS vision_cache ('
+                            'key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS vision_cache_accessed '
+                            'ON vision_cache (accessed)')
+            self.db.commit()
+
+    # image bytes are hashed as they are, an image url by its text
+    @staticmethod
+    def digest(source):
+        if isinstance(source, str):
+            source = ('uri:' + source).encode()
+        return hashlib.sha256(source).hexdigest()
+
+    # cached result of a feature for an image digest, None if missing or expired
+    def get(self, digest, feature):
+        key = digest + ':' + feature
+        now = time.time()
+        with self.lock:
+            if key in self.memory:
+                value, created = self.memory[key]
+                if now - created <= self.ttl:
+                    self.memory.move_to_end(key)
+                    return value
+                del self.memory[key]
+
+            if self.db is None:
+                return None
+            row = self.db.execute('SELECT value, created FROM vision_cache WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                return None
+            self.db.execute('UPDATE vision_cache SET accessed = ? WHERE key = ?', (now, key))
+            self.db.commit()
+
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            return value
+
+    def put(self, digest, feature, value):
+        key = digest + ':' + feature
+        now = time.time()
+        with self.lock:
+            self._remember(key, value, now)
+            if self.db is None:
+                return
+            self.db.execute('INSERT OR REPLACE INTO vision_cache VALUES (?, ?, ?, ?)',
+                            (key, json.dumps(value), now, now))
+            self.puts += 1
+            if self.puts % 100 == 0:
+                self._evictDisk(now)
+            self.db.commit()
+
+    # memory tier, least recently used entries go first
+    def _remember(self, key, value, created):
+        self.memory[key] = (value, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxEntries:
+            self.memory.popitem(last=False)
+
+    # disk tier: drop the expired entries, then the least recently used ones above the size limit
+    def _evictDisk(self, now):
+        self.db.execute('DELETE FROM vision_cache WHERE created < ?', (now - self.ttl,))
+        self.db.execute('DELETE FROM vision_cache WHERE key IN (SELECT key FROM vision_cache '
+                        'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.maxDiskEntries,))
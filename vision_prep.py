@@ -0,0 +1,104 @@
+# snapshot preparation before google vision: crop to the region of the camera where the plate is read,
+# downscale to maxSide and re-encode to at most maxBytes, so that less is uploaded and analyzed per call
+from PIL import Image
+import threading
+import time
+import io
+
+
+class VisionPrep:
+
+    # regions: {camera serial: [left, top, right, bottom]} in fractions of the frame, the whole frame by default
+    # maxSide: longest side in pixels sent to google vision, the plate characters must stay readable
+    # maxBytes: jpeg size budget, the quality goes down to minQuality then the image is shrunk further
+    def __init__(self, regions=None, maxSide=1600, maxBytes=500000, quality=85, minQuality=45, grayscale=False):
+        self.regions = regions or {}
+        self.maxSide = maxSide
+        self.maxBytes = maxBytes
+        self.quality = quality
+        self.minQuality = minQuality
+        self.grayscale = grayscale
+        self.preparedCount = 0
+        self.failureCount = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.totalMs = 0
+        self.lock = threading.Lock()
+
+    # crop box of a camera in pixels of an image of the given size
+    def regionBox(self, deviceSerial, size):
+        left, top, right, bottom = self.regions.get(deviceSerial, [0, 0, 1, 1])
+        width, height = size
+        return (int(left * width), int(top * height), int(right * width), int(bottom * height))
+
+    # the bytes to send to google vision, the original snapshot if it cannot be decoded
+    def prepare(self, deviceSerial, content):
+        start = time.perf_counter()
+        try:
+            prepared = self._prepare(deviceSerial, content)
+        except Exception as e:
+            print('Could not prepare the snapshot of {} for Google Vision = '.format(deviceSerial), e)
+            prepared = None
+        elapsed = (time.perf_counter() - start) * 1000
+
+        with self.lock:
+            self.preparedCount += 1
+            self.failureCount += prepared is None
+            self.bytesIn += len(content)
+            self.bytesOut += len(prepared if prepared is not None else content)
+            self.totalMs += elapsed
+        return prepared if prepared is not None else content
+
+    def _prepare(self, deviceSerial, content):
+        image = Image.open(io.BytesIO(content))
+        box = self.regionBox(deviceSerial, image.size)
+        cropWidth, cropHeight = box[2] - box[0], box[3] - box[1]
+        scale = min(1, self.maxSide / max(cropWidth, cropHeight, 1))
+        cropped = box != (0, 0) + image.size
+
+        # nothing to crop or shrink and already within budget: sent as is, without a second jpeg generation
+        if not cropped and scale == 1 and len(content) <= self.maxBytes:
+            return content
+
+        # let the jpeg decoder skip the detail lost by the downscale anyway
+        if scale <= 0.5:
+            fullWidth, fullHeight = image.size
+            image.draft('L' if self.grayscale else 'RGB',
+                        (int(fullWidth * scale) + 1, int(fullHeight * scale) + 1))
+            box = self.regionBox(deviceSerial, image.size)
+        image = image.convert('L' if self.grayscale else 'RGB')
+        if cropped:
+            image = image.crop(box)
+
+        size = image.size
+        scale = min(1, self.maxSide / max(size))
+        for attempt in range(4):
+            target = (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+            resized = image.resize(target, Image.BILINEAR, reducing_gap=2.0) if target != image.size else image
+            quality = self.quality
+            while True:
+                data = encodeJpeg(resized, quality)
+                if len(data) <= self.maxBytes or quality - 10 < self.minQuality:
+                    break
+                quality -= 10
+            if len(data) <= self.maxBytes:
+                break
+            # jpeg size grows about with the pixel count
+            scale *= min(0.9, (self.maxBytes / len(data)) ** 0.5)
+        return data
+
+    def stats(self):
+        with self.lock:
+            return {
+                'prepared': self.preparedCount,
+                'failures': self.failureCount,
+                'bytesIn': self.bytesIn,
+                'bytesOut': self.bytesOut,
+                'meanMs': round(self.totalMs / self.preparedCount, 3) if self.preparedCount else 0
+            }
+
+
+def encodeJpeg(image, quality):
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
@@ -0,0 +1,115 @@
+# outbound webex notifications: a priority queue drained by a dedicated sender thread
+# messages that could not be sent are kept in a SQLite outbox and sent again, also after a restart
+from webexteamssdk import RateLimitError
+import threading
+import sqlite3
+import heapq
+import json
+import time
+
+# lower is sent first
+PRIORITY_ARRIVED = 0
+PRIORITY_NO_MATCH = 1
+PRIORITY_NO_PLATE = 2
+
+
+class WebexSender:
+
+    # send: function posting one message, called with the keyword arguments of webexAPI.messages.create
+    def __init__(self, send, outboxPath='webex_outbox.db', retryInterval=30, maxAttempts=10):
+        self.send = send
+        self.retryInterval = retryInterval
+        self.maxAttempts = maxAttempts
+        self.queue = []
+        self.sequence = 0
+        self.pausedUntil = 0
+        self.running = False
+        self.condition = threading.Condition()
+        # the outbox is opened by start(), by the process sending the messages
+        self.outboxPath = outboxPath
+        self.db = None
+        self.dbLock = threading.Lock()
+
+    # queue a message, the keyword arguments are serialized right away so later changes by the caller do not leak in
+    def enqueue(self, priority, **message):
+        self._push(priority, json.dumps(message), 0)
+
+    # queue a message already serialized as JSON, e.g. rendered by CARD_TEMPLATE
+    def enqueueJson(self, priority, message):
+        self._push(priority, message, 0)
+
+    def _push(self, priority, message, attempts):
+        with self.condition:
+            heapq.heappush(self.queue, (priority, self.sequence, message, attempts))
+            self.sequence += 1
+            self.condition.notify()
+
+    def start(self):
+        self.db = sqlite3.connect(self.outboxPath, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, priority INTEGER, '
+                        'message TEXT, attempts INTEGER, next_attempt REAL)')
+        self.db.commit()
+        self.running = True
+        self.replayOutbox()
+        threading.Thread(target=self._run, name='webex-sender', daemon=True).start()
+        threading.Thread(target=self._retryLoop, name='webex-outbox', daemon=True).start()
+
+    # stop sending, the messages still queued are kept in the outbox
+    def stop(self):
+        with self.condition:
+            self.running = False
+            pending, self.queue = self.queue, []
+            self.condition.notify_all()
+        for priority, sequence, message, attempts in pending:
+            self._storeOutbox(priority, message, attempts, time.time())
+
+    def depth(self):
+        with self.condition:
+            return len(self.queue)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                # wait for a message, and for the end of a rate limit pause
+                while self.running and (not self.queue or time.time() < self.pausedUntil):
+                    self.condition.wait(max(self.pausedUntil - time.time(), 0) or None)
+                if not self.running:
+                    return
+                priority, sequence, message, attempts = heapq.heappop(self.queue)
+
+            try:
+                self.send(**json.loads(message))
+            except RateLimitError as e:
+                # same message first again once webex accepts requests
+                print('Webex rate limit, sending again in {} sec'.format(e.retry_after))
+                with self.condition:
+                    self.pausedUntil = time.time() + e.retry_after
+                    heapq.heappush(self.queue, (priority, sequence, message, attempts))
+            except Exception as e:
+                print('Could not send webex message, kept in the outbox = ', e)
+                self._storeOutbox(priority, message, attempts + 1,
+                                  time.time() + self.retryInterval * 2 ** attempts)
+
+    def _storeOutbox(self, priority, message, attempts, nextAttempt):
+        with self.dbLock:
+            self.db.execute('INSERT INTO outbox (priority, message, attempts, next_attempt) VALUES (?, ?, ?, ?)',
+                            (priority, message, attempts, nextAttempt))
+            self.db.commit()
+
+    # move the outbox messages due for another attempt back to the queue
+    # messages above maxAttempts stay in the outbox for a manual check
+    def replayOutbox(self):
+        with self.dbLock:
+            rows = self.db.execute('SELECT id, priority, message, attempts FROM outbox '
+                                   'WHERE next_attempt <= ? AND attempts < ?',
+                                   (time.time(), self.maxAttempts)).fetchall()
+            self.db.executemany('DELETE FROM outbox WHERE id = ?',
+                                [(row[0],) for row in rows])
+            self.db.commit()
+        for rowId, priority, message, attempts in rows:
+            self._push(priority, message, attempts)
+
+    def _retryLoop(self):
+        while self.running:
+            time.sleep(self.retryInterval)
+            self.replayOutbox()
@@ -0,0 +1,152 @@
+# write-behind buffer: records are accepted without waiting for the database, then written in batches
+from collections import deque
+import threading
+import json
+import time
+import os
+
+
+class WriteBehindBuffer:
+
+    # flush: function writing a list of records, returns how many of them were written (the first ones)
+    # spillPath: JSONL file keeping the records that could not be written on shutdown, written again on the next start
+    # maxDepth: records kept while the database is unreachable, the next ones are dropped
+    def __init__(self, flush, maxBatch=50, maxDelay=1.0, retryDelay=5.0, spillPath=None, maxDepth=10000):
+        self.flush = flush
+        self.maxBatch = maxBatch
+        self.maxDepth = maxDepth
+        self.droppedCount = 0
+        self.maxDelay = maxDelay
+        self.retryDelay = retryDelay
+        self.spillPath = spillPath
+        self.records = deque()
+        self.spilled = 0
+        self.oldest = None
+        self.running = True
+        self.condition = threading.Condition()
+        self.flushedCount = 0
+        self.flushCount = 0
+        self.failureCount = 0
+        self.lastFlushMs = 0
+        self.totalFlushMs = 0
+        self.thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+
+    # replay the spill file and start writing, once per process owning the spill file
+    def start(self):
+        with self.condition:
+            spill = self._readSpill()
+            self.records.extendleft(reversed(spill))
+            # the spill file is removed once its records are written
+            self.spilled = len(spill)
+            if self.records:
+                self.oldest = time.monotonic()
+        self.thread.start()
+
+    # returns False if the record is dropped, the buffer being full
+    def add(self, record):
+        with self.condition:
+            if len(self.records) >= self.maxDepth:
+                self.droppedCount += 1
+                if self.droppedCount % 100 == 1:
+                    print('Write-behind buffer full, {} records dropped'.format(self.droppedCount))
+                return False
+            # the first record starts the maxDelay countdown of the idle writer thread
+            if not self.records:
+                self.oldest = time.monotonic()
+                self.condition.notify()
+            self.records.append(record)
+            if len(self.records) >= self.maxBatch:
+                self.condition.notify()
+            return True
+
+    # flush what is left and stop, used on shutdown
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                # wait for a full batch, or for the oldest record to be maxDelay old
+                while self.running and (not self.records or (
+                        len(self.records) < self.maxBatch and time.monotonic() - self.oldest < self.maxDelay)):
+                    timeout = self.oldest + self.maxDelay - time.monotonic() if self.records else None
+                    self.condition.wait(timeout)
+                if not self.records:
+                    return
+                batch = [self.records[i] for i in range(min(self.maxBatch, len(self.records)))]
+
+            written = self._write(batch)
+
+            with self.condition:
+                for i in range(written):
+                    self.records.popleft()
+                self.oldest = time.monotonic() if self.records else None
+                stopping = not self.running
+                if self.spilled and written:
+                    self.spilled = max(0, self.spilled - written)
+                    if self.spilled == 0 and os.path.exists(self.spillPath):
+                        os.remove(self.spillPath)
+
+            # the database is not reachable: wait before trying again, except on shutdown
+            if written == 0:
+                if stopping:
+                    self._spill()
+                    return
+                time.sleep(self.retryDelay)
+
+    # keep the records not written on shutdown, the file is replaced as it may still hold the replayed ones
+    def _spill(self):
+        with self.condition:
+            records = list(self.records)
+        if not self.spillPath:
+            print('Could not write {} buffered records on shutdown'.format(len(records)))
+            return
+        with open(self.spillPath + '.tmp', 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.spillPath + '.tmp', self.spillPath)
+        print('Could not write {} buffered records on shutdown, kept in {}'.format(len(records), self.spillPath))
+
+    def _readSpill(self):
+        if not self.spillPath or not os.path.exists(self.spillPath):
+            return []
+        with open(self.spillPath) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        print('Writing again {} records kept in {}'.format(len(records), self.spillPath))
+        return records
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            written = self.flush(batch)
+        except Exception as e:
+            print('Could not flush the write-behind buffer = ', e)
+            written = 0
+        elapsed = (time.perf_counter() - start) * 1000
+
+        with self.condition:
+            self.flushCount += 1
+            self.flushedCount += written
+            self.failureCount += written < len(batch)
+            self.lastFlushMs = elapsed
+            self.totalFlushMs += elapsed
+        return written
+
+    def stats(self):
+        with self.condition:
+            return {
+                'depth': len(self.records),
+                'spilled': self.spilled,
+                'dropped': self.droppedCount,
+                'flushed': self.flushedCount,
+                'flushes': self.flushCount,
+                'failures': self.failureCount,
+                'lastFlushMs': round(self.lastFlushMs, 3),
+                'meanFlushMs': round(self.totalFlushMs / self.flushCount, 3) if self.flushCount else 0
+            }